@@ -10,7 +10,7 @@ from fastapi.responses import FileResponse
 from fastapi.concurrency import run_in_threadpool
 
 from app.config import settings
-from app.models.schemas import ConvertResponse
+from app.models.schemas import ConvertResponse, LayerInfo
 from app.services import conversion
 from app.services import geoserver_client as gs
 
@@ -64,7 +64,7 @@ def process_conversion_task(job_id: str, dwg_path: Path, job_dir: Path, original
         # caused by non-ASCII characters in filenames (e.g. Chinese)
         layer_name = f"layer_{job_id}"
         
-        ok_ws, _ = gs.ensure_workspace()
+        ok_ws, _ = gs.ensure_workspace(gs.workspace_for(layer_name))
         if ok_ws:
             # OGR2OGR produces "entities" table by default for DXF
             ok_pub, pub_err = gs.publish_gpkg(gpkg_path, store_name, layer_name, native_layer_name="entities")
@@ -256,7 +256,7 @@ async def get_status(job_id: str):
     return _job_response(job_id)
 
 
-@router.get("/layers/{job_id}", response_model=list[dict])
+@router.get("/layers/{job_id}", response_model=list[LayerInfo])
 async def get_job_layers(job_id: str):
     """获取指定任务的图层列表（包含名称和颜色）"""
     # 优先从内存任务记录获取路径
@@ -26,6 +26,11 @@ class Settings(BaseSettings):
     geoserver_workspace: str = "dwg"
     # 前端可访问的 GeoServer 基础 URL（若与后端同域可一致）
     geoserver_public_url: str | None = None
+    # 同时发往 GeoServer 的最大请求数（默认 min(8, 2 × CPU 核数)），避免压垮其请求线程池
+    geoserver_max_concurrency: int | None = None
+    # workspace 分片数：>1 时图层按名称哈希分布到 {workspace}_{n}，减轻单个 workspace 的目录加载/REST 锁竞争
+    # （修改后已发布图层的 URL 会随之变化，只建议在新部署时设置）
+    geoserver_workspace_shards: int = 1
 
     class Config:
         env_prefix = "APP_"
@@ -1,9 +1,26 @@
 # -*- coding: utf-8 -*-
 """DWG 转切片后端：上传 → LibreDWG → GDAL → GeoServer"""
+import atexit
+import logging
+import logging.handlers
+import queue
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.routes import router
+from app.services import geoserver_client
+
+# 日志经队列由后台线程写出，转换线程不在 stdout 上阻塞
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))  # 只合并参数，完整格式由监听端处理
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 app = FastAPI(
     title="DWG 转切片 API",
@@ -19,6 +36,12 @@ app.add_middleware(
 app.include_router(router)
 
 
+@app.on_event("shutdown")
+def _close_geoserver_client():
+    # 先于 atexit 关闭共享 GeoServer 连接池，避免进程退出时残留 keep-alive 连接
+    geoserver_client.close_client()
+
+
 @app.get("/")
 async def root():
     return {"service": "dwg-to-tiles", "docs": "/docs"}
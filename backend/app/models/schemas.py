@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 """API 请求/响应模型"""
+from dataclasses import dataclass
+
 from pydantic import BaseModel, Field
 
 
@@ -19,3 +21,10 @@ class ConvertResponse(BaseModel):
     wmts_url: str | None = Field(None, description="WMTS Capabilities URL")
     # 图层边界 [minx, miny, maxx, maxy] EPSG:4326
     bbox: list[float] | None = Field(None, description="图层边界 [minx, miny, maxx, maxy] EPSG:4326")
+
+
+@dataclass(frozen=True, slots=True)
+class LayerInfo:
+    """DWG 图层名称及其代表颜色（出现最多的 line_color）"""
+    name: str
+    color: str
@@ -8,10 +8,20 @@ import os
 import shutil
 import time
 import struct
+import json
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 import math
 
+import numpy as np
+
 from app.config import settings
+from app.models.schemas import LayerInfo
+
+log = logging.getLogger(__name__)
 
 # AutoCAD Color Index (ACI) to Hex mapping (0-255)
 # Using a simplified palette for brevity, filling the rest with black
@@ -34,6 +44,12 @@ ACI_HEX = [
 while len(ACI_HEX) < 256:
     ACI_HEX.append("#000000")
 
+# OGR_STYLE LABEL(...) key:value pairs, e.g. f:"Arial",t:"+0,000",s:250g
+_LABEL_KV_RE = re.compile(r'([a-zA-Z]+):("[^"]*"|[^,]+)')
+
+# Below this many styled rows the process pool start-up/IPC costs more than it saves
+_STYLE_PARALLEL_MIN_ROWS = 200000
+
 # Setup GDAL/PROJ environment variables dynamically
 ENV_GDAL = os.environ.copy()
 try:
@@ -63,10 +79,20 @@ try:
         if proj_lib.exists():
             ENV_GDAL["PROJ_LIB"] = str(proj_lib)
 except Exception as e:
-    print(f"Error setting up environment: {e}")
+    log.warning("Error setting up environment: %s", e)
+
+# Extra env for reprojection passes: multi-threaded PROJ transforms via the Arrow batch path (GDAL >= 3.10)
+ENV_REPROJECT = {"GDAL_NUM_THREADS": "ALL_CPUS", "OGR2OGR_USE_ARROW_API": "YES"}
+
+# ogr2ogr options for throwaway GPKG outputs (rewritten or discarded on failure): no fsync, in-memory journal
+OGR_FAST_WRITE = [
+    "--config", "OGR_SQLITE_SYNCHRONOUS", "OFF",
+    "--config", "OGR_SQLITE_JOURNAL", "MEMORY",
+    "--config", "OGR_SQLITE_CACHE", "1024",
+]
 
-def _run(cmd: list[str], cwd: Path | None = None, timeout: int = 300) -> tuple[bool, str]:
-    """Execute command, return (success, stderr/stdout)"""
+def _run(cmd: list[str], cwd: Path | None = None, timeout: int = 300, env: dict | None = None) -> tuple[bool, str]:
+    """Execute command, return (success, stderr/stdout). `env` entries override ENV_GDAL for this call."""
     # DEBUG: Log environment and command
     if cwd:
         try:
@@ -83,7 +109,7 @@ def _run(cmd: list[str], cwd: Path | None = None, timeout: int = 300) -> tuple[b
         r = subprocess.run(
             cmd,
             cwd=cwd,
-            env=ENV_GDAL,
+            env={**ENV_GDAL, **env} if env else ENV_GDAL,
             capture_output=True,
             text=True,
             timeout=timeout,
@@ -143,7 +169,7 @@ def detect_encoding(file_path: Path) -> str:
 def repair_dxf_encoding(dxf_path: Path):
     """Convert DXF to UTF-8 and fix header for GDAL (Streaming version for large files)"""
     enc = detect_encoding(dxf_path)
-    print(f"Detected encoding for {dxf_path.name}: {enc}")
+    log.info("Detected encoding for %s: %s", dxf_path.name, enc)
     
     temp_path = dxf_path.with_name(f"{dxf_path.stem}_temp.dxf")
     
@@ -194,7 +220,7 @@ def repair_dxf_encoding(dxf_path: Path):
         temp_path.rename(dxf_path)
         
     except Exception as e:
-        print(f"Encoding repair failed: {e}")
+        log.warning("Encoding repair failed: %s", e)
         if temp_path.exists():
             temp_path.unlink()
 
@@ -242,7 +268,7 @@ def parse_dxf_layers(dxf_path: Path) -> dict[str, str]:
                     except:
                         pass
     except Exception as e:
-        print(f"Layer parsing failed: {e}")
+        log.warning("Layer parsing failed: %s", e)
     return layers
 
 def extract_dxf_attributes(dxf_path: Path) -> dict[str, dict]:
@@ -456,53 +482,139 @@ def extract_dxf_attributes(dxf_path: Path) -> dict[str, dict]:
                 pass
                 
     except Exception as e:
-        print(f"Attribute extraction failed: {e}")
+        log.warning("Attribute extraction failed: %s", e)
         
     return results
 
+# GPKG 几何头长度，按 flags bit1-3 的 envelope 类型索引：8 字节定长头 + 无/xy/xyz/xym/xyzm envelope（5-7 非法按无处理）
+_GPKG_HDR_LEN = (8, 8 + 32, 8 + 48, 8 + 48, 8 + 64, 8, 8, 8)
+# WKB 字节序字节 -> 预编译的 (x, y) 双精度编解码器（0=Big，其余按 Little）
+_WKB_XY = (struct.Struct(">2d"), struct.Struct("<2d"))
+
 def apply_geometry_shift(blob, dx, dy):
     """Shift GeoPackage geometry blob by dx, dy"""
     if not blob: return blob
     try:
         # GeoPackage Header
-        if blob[:2] != b'GP': return blob
-        
-        flags = blob[3]
-        envelope_indicator = (flags >> 1) & 0x07
-        
-        header_len = 8 
-        if envelope_indicator == 1: header_len += 32
-        elif envelope_indicator == 2: header_len += 48
-        elif envelope_indicator == 3: header_len += 64
-        elif envelope_indicator == 4: header_len += 80
+        if not blob.startswith(b'GP'): return blob
         
         # WKB Start
-        wkb_start = header_len
+        wkb_start = _GPKG_HDR_LEN[(blob[3] >> 1) & 0x07]
         if len(blob) < wkb_start + 21: return blob
         
-        byte_order = blob[wkb_start] # 0=Big, 1=Little
-        endian = '>' if byte_order == 0 else '<'
+        xy = _WKB_XY[blob[wkb_start] != 0]
         
         # Geometry Type (4 bytes) - check if it looks like a point
         # We assume X and Y are always at offset 5 for Points
         
         # X starts at wkb_start + 5
         x_offset = wkb_start + 5
-        x = struct.unpack(endian + 'd', blob[x_offset:x_offset+8])[0]
-        y = struct.unpack(endian + 'd', blob[x_offset+8:x_offset+16])[0]
+        x, y = xy.unpack_from(blob, x_offset)
         
-        new_x = x + dx
-        new_y = y + dy
-        
-        new_x_bytes = struct.pack(endian + 'd', new_x)
-        new_y_bytes = struct.pack(endian + 'd', new_y)
-        
-        # Reconstruct
-        new_blob = blob[:x_offset] + new_x_bytes + new_y_bytes + blob[x_offset+16:]
-        return new_blob
+        # Patch the coordinates in a single copy instead of slicing and re-concatenating
+        new_blob = bytearray(blob)
+        xy.pack_into(new_blob, x_offset, x + dx, y + dy)
+        return bytes(new_blob)
     except:
         return blob
 
+def _parse_style_row(row: tuple) -> tuple | None:
+    """Parse one (rowid, OGR_STYLE, text_size) row into an entities UPDATE tuple, or None if nothing to set"""
+    rid, style, existing_size = row
+    l_c = None
+    f_c = None
+    rot = None
+
+    t_font = None
+    t_size = existing_size
+    t_color = None
+    t_angle = None
+    t_text = None
+
+    if "PEN(" in style:
+        try:
+            p = style.partition("PEN(")[2].partition(")")[0]
+            for kv in p.split(","):
+                if kv.startswith("c:"): 
+                    l_c = kv[2:]
+                    # Strip alpha if present (8 chars hex)
+                    if l_c.startswith('#') and len(l_c) > 7:
+                        l_c = l_c[:7]
+                    # Remap Black to White for black background
+                    if l_c.lower() == "#000000":
+                        l_c = "#FFFFFF"
+        except: pass
+    if "BRUSH(" in style:
+        try:
+            p = style.partition("BRUSH(")[2].partition(")")[0]
+            for kv in p.split(","):
+                if kv.startswith("fc:"): 
+                    f_c = kv[3:]
+                    # Strip alpha if present (8 chars hex)
+                    if f_c.startswith('#') and len(f_c) > 7:
+                        f_c = f_c[:7]
+                    # Remap Black to White for black background (though fill usually isn't black)
+                    if f_c.lower() == "#000000":
+                        f_c = "#FFFFFF"
+        except: pass
+    if "LABEL(" in style:
+        try:
+            # Parse LABEL style using regex to handle quotes safely
+            # Example: LABEL(f:"Arial",t:"+0,000",s:250g,w:90,p:7,c:#00000000)
+            p_start = style.find("LABEL(") + 6
+            p_end = style.rfind(")")
+            if p_start > 5 and p_end > p_start:
+                content = style[p_start:p_end]
+                matches = _LABEL_KV_RE.findall(content)
+                for k, v in matches:
+                    if v.startswith('"') and v.endswith('"'):
+                        v = v[1:-1]
+
+                    if k == 'f': t_font = v
+                    elif k == 's': 
+                        try:
+                            # remove unit suffix if any (g=ground, p=points, m=mm, etc)
+                            val_str = v.rstrip("gpm")
+                            t_size = float(val_str)
+                        except: pass
+                    elif k == 'c': 
+                        t_color = v
+                        if t_color.startswith('#') and len(t_color) > 7:
+                            t_color = t_color[:7]
+                        if t_color.lower() == "#000000":
+                            t_color = "#FFFFFF"
+                    elif k == 'a': 
+                        try: t_angle = float(v)
+                        except: pass
+                    elif k == 't': t_text = v
+                    elif k == 'p': pass # priority/position
+
+                # If we found label attributes, set generic ones too if missing
+                if t_color and not l_c: l_c = t_color
+                if t_angle is not None: rot = t_angle
+        except Exception as e:
+            # print(f"Label parse error: {e}")
+            pass
+
+    if any(x is not None for x in [l_c, f_c, rot, t_font, t_size, t_color, t_angle, t_text]):
+        return (l_c, f_c, rot, t_font, t_size, t_color, t_angle, t_text, rid)
+    return None
+
+
+def _parse_style_chunk(rows: list) -> list:
+    """Parse a slice of style rows (runs in a worker process for large drawings)"""
+    # Pre-size the result and trim once, instead of growing it row by row
+    updates = [None] * len(rows)
+    idx = 0
+    for row in rows:
+        u = _parse_style_row(row)
+        if u is not None:
+            updates[idx] = u
+            idx += 1
+    del updates[idx:]
+    return updates
+
+
 def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None) -> tuple[bool, Path | None, str]:
     job_id = output_dir.name
     temp_dwg = output_dir / f"temp_{job_id}.dwg"
@@ -533,7 +645,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
     try:
         repair_dxf_encoding(dxf_path)
     except Exception as e:
-        print(f"Encoding repair warning: {e}")
+        log.warning("Encoding repair warning: %s", e)
     
     # 4. Parse Layers
     if progress_callback: progress_callback(50, "正在解析图层...")
@@ -579,7 +691,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
             # 这是典型的 3 度带高斯 - 克吕格投影
             # 39 带的中央经线 = 39 * 3 = 117°（适用于中国东部：北京、天津、山东、江苏等）
             zone = 39
-            print(f"自动检测到高斯 - 克吕格 3 度带，带号={zone}")
+            log.info("自动检测到高斯 - 克吕格 3 度带，带号=%s", zone)
         
         # 高斯 - 克吕格 3 度带投影参数
         # 中央经线 = 带号 × 3
@@ -594,7 +706,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
             "-s_srs", source_srs,
             "-t_srs", target_srs
         ])
-        print(f"启用高斯 - 克吕格投影转换：带号={zone}, 中央经线={central_meridian}°, 东偏移={false_easting}")
+        log.info("启用高斯 - 克吕格投影转换：带号=%s, 中央经线=%s°, 东偏移=%s", zone, central_meridian, false_easting)
 
     # DEBUG: Log environment and command
     try:
@@ -623,7 +735,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
     # Threshold increased to 500 to catch cases where only few entities (like border) are converted
     # but the main content (in blocks) is missing.
     if ok and count < 500:
-         print(f"Initial conversion resulted in only {count} entities. Retrying without inline blocks...")
+         log.info("Initial conversion resulted in only %s entities. Retrying without inline blocks...", count)
          
          # Backup original GPKG just in case retry is worse
          gpkg_backup = gpkg_path.with_suffix(".gpkg.bak")
@@ -642,10 +754,10 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
          
          # Compare results
          count_retry = check_gpkg_count(gpkg_path)
-         print(f"Retry result: {count_retry} entities")
+         log.info("Retry result: %s entities", count_retry)
          
          if not ok_retry or count_retry <= count:
-             print("Retry was worse or failed, reverting to original...")
+             log.warning("Retry was worse or failed, reverting to original...")
              try:
                  if gpkg_backup.exists():
                      shutil.move(gpkg_backup, gpkg_path)
@@ -726,7 +838,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
             # First, parse Layer Colors to handle ByLayer entities
             layer_colors = parse_dxf_layers(dxf_path)
             if not layer_colors:
-                print("Warning: No layer colors found")
+                log.warning("No layer colors found")
             
             attrs_map = extract_dxf_attributes(dxf_path)
             if attrs_map:
@@ -803,7 +915,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                 
                 # Apply geometry shifts
                 if shifts:
-                    print(f"Applying geometry shift to {len(shifts)} text entities...")
+                    log.info("Applying geometry shift to %s text entities...", len(shifts))
                     try:
                         c.execute("CREATE TEMPORARY TABLE IF NOT EXISTS text_shifts (handle TEXT PRIMARY KEY, dx REAL, dy REAL)")
                         c.execute("DELETE FROM text_shifts")
@@ -829,7 +941,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                         c.execute("DROP TABLE text_shifts")
                         
                     except Exception as e:
-                        print(f"Batch geometry shift error: {e}")
+                        log.warning("Batch geometry shift error: %s", e)
                         for dx, dy, handle in shifts:
                             try:
                                 c.execute("SELECT geom FROM entities WHERE EntityHandle=?", (handle,))
@@ -863,7 +975,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                             
                         c.execute("DROP TABLE text_sizes")
                     except Exception as e:
-                        print(f"Text size batch update error: {e}")
+                        log.warning("Text size batch update error: %s", e)
                         try:
                              c.executemany("UPDATE entities SET text_size=? WHERE EntityHandle=?", sizes)
                         except: pass
@@ -874,34 +986,34 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                          c.executemany("UPDATE entities SET text_angle=? WHERE EntityHandle=?", rotations)
                          c.executemany("UPDATE entities SET rotation=COALESCE(rotation, ?) WHERE EntityHandle=?", rotations)
                      except Exception as e:
-                         print(f"Rotation update error: {e}")
+                         log.warning("Rotation update error: %s", e)
                      
                 # Update Colors (New)
                 if text_colors:
                     try:
                         c.executemany("UPDATE entities SET text_color=? WHERE EntityHandle=?", text_colors)
                     except Exception as e:
-                        print(f"Text color update error: {e}")
+                        log.warning("Text color update error: %s", e)
                     
                 if line_colors:
                     try:
                         c.executemany("UPDATE entities SET line_color=? WHERE EntityHandle=?", line_colors)
                     except Exception as e:
-                        print(f"Line color update error: {e}")
+                        log.warning("Line color update error: %s", e)
                         
                 # Update Fill Colors (New)
                 if fill_colors:
                     try:
                         c.executemany("UPDATE entities SET fill_color=? WHERE EntityHandle=?", fill_colors)
                     except Exception as e:
-                         print(f"Fill color update error: {e}")
+                         log.warning("Fill color update error: %s", e)
                          
                 # Update Line Widths (New)
                 if line_widths:
                     try:
                         c.executemany("UPDATE entities SET line_width=? WHERE EntityHandle=?", line_widths)
                     except Exception as e:
-                        print(f"Line width update error: {e}")
+                        log.warning("Line width update error: %s", e)
                 
                 # Update Full Text (New - Fix truncation issues)
                 # We collect full text from DXF (Group 3 + Group 1) and overwrite the potentially truncated text in GPKG
@@ -917,10 +1029,10 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                         if 'text_content' in cols:
                              c.executemany("UPDATE entities SET text_content=? WHERE EntityHandle=?", full_texts)
                     except Exception as e:
-                        print(f"Full text update error: {e}")
+                        log.warning("Full text update error: %s", e)
 
         except Exception as e:
-            print(f"Attribute parsing warning: {e}")
+            log.warning("Attribute parsing warning: %s", e)
             
         # 8. Decode Multibyte Text (MIF \M+nXXXX)
         # This handles cases where GDAL/LibreDWG didn't decode the specific codepage (e.g. GBK \M+5xxxx)
@@ -930,7 +1042,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                  c.execute("SELECT rowid, Text FROM entities WHERE Text LIKE '%\\M+%' ESCAPE '!'")
                  rows = c.fetchall()
                  if rows:
-                     print(f"Found {len(rows)} entities with potential encoded text")
+                     log.info("Found %s entities with potential encoded text", len(rows))
                      updates = []
                      import re
                      # Regex for \M+nXXXX (n=digit, XXXX=hex)
@@ -965,14 +1077,14 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                          except Exception: pass
                      
                      if updates:
-                         print(f"Decoded {len(updates)} text entities")
+                         log.info("Decoded %s text entities", len(updates))
                          c.executemany("UPDATE entities SET Text=? WHERE rowid=?", updates)
                          # Also update text_content if it exists
                          if 'text_content' in cols:
                              c.executemany("UPDATE entities SET text_content=? WHERE rowid=?", updates)
                              
              except Exception as e:
-                 print(f"Text decoding error: {e}")
+                 log.warning("Text decoding error: %s", e)
 
         # Remove text from Hatch entities (often pattern names like SOLID, HONEY)
         # We do this early to ensure it runs even if later steps fail
@@ -983,7 +1095,7 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                  if 'SubClasses' in cols:
                      c.execute("UPDATE entities SET Text = NULL WHERE SubClasses LIKE '%AcDbHatch%'")
              except Exception as e:
-                 print(f"Hatch text cleanup error: {e}")
+                 log.warning("Hatch text cleanup error: %s", e)
                  
         # Additional cleanup for attribute fields that might contain hatch pattern names
         # Check for any column that might hold the pattern name if 'Text' was empty but now populated
@@ -996,127 +1108,112 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
                 # Include existing text_size in selection to preserve it if style doesn't override
                 c.execute("SELECT rowid, style, text_size FROM entities WHERE style IS NOT NULL")
                 rows = c.fetchall()
-                for rid, style, existing_size in rows:
-                    l_c = None
-                    f_c = None
-                    rot = None
-                    
-                    t_font = None
-                    t_size = existing_size
-                    t_color = None
-                    t_angle = None
-                    t_text = None
-                    
-                    if "PEN(" in style:
-                        try:
-                            p = style.split("PEN(")[1].split(")")[0]
-                            for kv in p.split(","):
-                                if kv.startswith("c:"): 
-                                    l_c = kv[2:]
-                                    # Strip alpha if present (8 chars hex)
-                                    if l_c.startswith('#') and len(l_c) > 7:
-                                        l_c = l_c[:7]
-                                    # Remap Black to White for black background
-                                    if l_c.lower() == "#000000":
-                                        l_c = "#FFFFFF"
-                        except: pass
-                    if "BRUSH(" in style:
-                        try:
-                            p = style.split("BRUSH(")[1].split(")")[0]
-                            for kv in p.split(","):
-                                if kv.startswith("fc:"): 
-                                    f_c = kv[3:]
-                                    # Strip alpha if present (8 chars hex)
-                                    if f_c.startswith('#') and len(f_c) > 7:
-                                        f_c = f_c[:7]
-                                    # Remap Black to White for black background (though fill usually isn't black)
-                                    if f_c.lower() == "#000000":
-                                        f_c = "#FFFFFF"
-                        except: pass
-                    if "LABEL(" in style:
-                        try:
-                            # Parse LABEL style using regex to handle quotes safely
-                            # Example: LABEL(f:"Arial",t:"+0,000",s:250g,w:90,p:7,c:#00000000)
-                            p_start = style.find("LABEL(") + 6
-                            p_end = style.rfind(")")
-                            if p_start > 5 and p_end > p_start:
-                                content = style[p_start:p_end]
-                                matches = re.findall(r'([a-zA-Z]+):(".*?"|[^,]+)', content)
-                                for k, v in matches:
-                                    if v.startswith('"') and v.endswith('"'):
-                                        v = v[1:-1]
-                                    
-                                    if k == 'f': t_font = v
-                                    elif k == 's': 
-                                        try:
-                                            # remove unit suffix if any (g=ground, p=points, m=mm, etc)
-                                            val_str = v.rstrip("gpm")
-                                            t_size = float(val_str)
-                                        except: pass
-                                    elif k == 'c': 
-                                        t_color = v
-                                        if t_color.startswith('#') and len(t_color) > 7:
-                                            t_color = t_color[:7]
-                                        if t_color.lower() == "#000000":
-                                            t_color = "#FFFFFF"
-                                    elif k == 'a': 
-                                        try: t_angle = float(v)
-                                        except: pass
-                                    elif k == 't': t_text = v
-                                    elif k == 'p': pass # priority/position
-                                    
-                                # If we found label attributes, set generic ones too if missing
-                                if t_color and not l_c: l_c = t_color
-                                if t_angle is not None: rot = t_angle
-                        except Exception as e:
-                            # print(f"Label parse error: {e}")
-                            pass
-
-                    if any(x is not None for x in [l_c, f_c, rot, t_font, t_size, t_color, t_angle, t_text]):
-                        updates.append((l_c, f_c, rot, t_font, t_size, t_color, t_angle, t_text, rid))
+                if len(rows) >= _STYLE_PARALLEL_MIN_ROWS and (os.cpu_count() or 1) > 1:
+                    # Style parsing is pure Python and CPU-bound: fan out over processes, keep writes here
+                    k = os.cpu_count()
+                    try:
+                        with ProcessPoolExecutor(max_workers=k) as ex:
+                            chunks = [rows[i::k] for i in range(k)]
+                            for part in ex.map(_parse_style_chunk, chunks):
+                                updates.extend(part)
+                    except Exception as e:
+                        log.warning("Parallel style parsing failed, parsing serially: %s", e)
+                        updates = _parse_style_chunk(rows)
+                else:
+                    updates = _parse_style_chunk(rows)
             except Exception as e:
-                print(f"Style processing error: {e}")
+                log.warning("Style processing error: %s", e)
                 
         if updates:
             try:
-                c.executemany("""
-                    UPDATE entities SET 
-                        line_color=COALESCE(?, line_color), 
-                        fill_color=COALESCE(?, fill_color), 
-                        rotation=COALESCE(?, rotation),
-                        text_font=COALESCE(?, text_font),
-                        text_size=COALESCE(?, text_size),
-                        text_color=COALESCE(?, text_color),
-                        text_angle=COALESCE(?, text_angle),
-                        text_content=COALESCE(?, text_content)
-                    WHERE rowid=?
-                """, updates)
+                # Stage parsed styles in a temp table and merge them in one pass keyed on rowid
+                c.execute("DROP TABLE IF EXISTS temp.tmp_parsed")
+                c.execute("""
+                    CREATE TEMP TABLE tmp_parsed(
+                        line_color TEXT, fill_color TEXT, rotation REAL, text_font TEXT, text_size REAL,
+                        text_color TEXT, text_angle REAL, text_content TEXT, rid INTEGER PRIMARY KEY)
+                """)
+                c.executemany("INSERT OR REPLACE INTO tmp_parsed VALUES(?,?,?,?,?,?,?,?,?)", updates)
+                try:
+                    c.execute("""
+                        UPDATE entities SET 
+                            line_color=COALESCE(p.line_color, entities.line_color), 
+                            fill_color=COALESCE(p.fill_color, entities.fill_color), 
+                            rotation=COALESCE(p.rotation, entities.rotation),
+                            text_font=COALESCE(p.text_font, entities.text_font),
+                            text_size=COALESCE(p.text_size, entities.text_size),
+                            text_color=COALESCE(p.text_color, entities.text_color),
+                            text_angle=COALESCE(p.text_angle, entities.text_angle),
+                            text_content=COALESCE(p.text_content, entities.text_content)
+                        FROM tmp_parsed AS p
+                        WHERE entities.rowid = p.rid
+                    """)
+                except sqlite3.OperationalError:
+                    # SQLite < 3.33 has no UPDATE ... FROM
+                    c.executemany("""
+                        UPDATE entities SET 
+                            line_color=COALESCE(?, line_color), 
+                            fill_color=COALESCE(?, fill_color), 
+                            rotation=COALESCE(?, rotation),
+                            text_font=COALESCE(?, text_font),
+                            text_size=COALESCE(?, text_size),
+                            text_color=COALESCE(?, text_color),
+                            text_angle=COALESCE(?, text_angle),
+                            text_content=COALESCE(?, text_content)
+                        WHERE rowid=?
+                    """, updates)
+                c.execute("DROP TABLE IF EXISTS temp.tmp_parsed")
             except Exception as e:
-                print(f"Style update error: {e}")
+                log.warning("Style update error: %s", e)
         
         # Update layer colors
-        if 'Layer' in cols:
-            for layer, color in layer_colors.items():
-                # Remap Black to White for layer colors too
-                if color and color.lower() == "#000000":
-                    color = "#FFFFFF"
-                    
-                # Update if line_color is NULL, OR if it's White/Black (likely default) and layer has a specific color
-                # This helps recover "ByLayer" colors where OGR_STYLE defaulted to black
-                c.execute("""
+        if 'Layer' in cols and layer_colors:
+            # Remap Black to White for layer colors too
+            layer_pairs = [
+                ("#FFFFFF" if color and color.lower() == "#000000" else color, layer)
+                for layer, color in layer_colors.items()
+            ]
+            # Update if line_color is NULL, OR if it's White/Black (likely default) and layer has a specific color
+            # This helps recover "ByLayer" colors where OGR_STYLE defaulted to black
+            layers_done = False
+            if len(layer_pairs) < 1000:
+                # Small layer tables: one statement joined against a JSON document
+                try:
+                    payload = json.dumps([{"l": l, "c": lc} for lc, l in layer_pairs])
+                    c.execute("""
+                        UPDATE entities
+                        SET line_color = json_extract(je.value, '$.c')
+                        FROM (SELECT value FROM json_each(?)) AS je
+                        WHERE entities.Layer = json_extract(je.value, '$.l')
+                        AND (entities.line_color IS NULL OR entities.line_color IN ('#FFFFFF', '#000000'))
+                    """, (payload,))
+                    layers_done = True
+                except sqlite3.OperationalError as e:
+                    log.warning("json_each layer color update failed, using per-layer updates: %s", e)
+            if not layers_done:
+                c.executemany("""
                     UPDATE entities 
                     SET line_color = ? 
                     WHERE Layer = ? 
                     AND (line_color IS NULL OR line_color IN ('#FFFFFF', '#000000'))
-                """, (color, layer))
+                """, layer_pairs)
                 
         # Force Black to White cleanup globally (run AFTER layer updates to catch ByLayer blacks)
+        # Single pass: black -> white for both colors, and fall back to text color for missing line color
         try:
-            c.execute("UPDATE entities SET line_color='#FFFFFF' WHERE line_color='#000000'")
-            c.execute("UPDATE entities SET text_color='#FFFFFF' WHERE text_color='#000000'")
-            c.execute("UPDATE entities SET line_color=text_color WHERE line_color IS NULL AND text_color IS NOT NULL")
+            c.execute("""
+                UPDATE entities SET
+                    line_color = CASE
+                        WHEN line_color = '#000000' THEN '#FFFFFF'
+                        WHEN line_color IS NULL THEN
+                            CASE WHEN text_color = '#000000' THEN '#FFFFFF' ELSE text_color END
+                        ELSE line_color END,
+                    text_color = CASE WHEN text_color = '#000000' THEN '#FFFFFF' ELSE text_color END
+                WHERE line_color = '#000000' OR text_color = '#000000'
+                   OR (line_color IS NULL AND text_color IS NOT NULL)
+            """)
         except Exception as e:
-            print(f"Color cleanup error: {e}")
+            log.warning("Color cleanup error: %s", e)
 
         conn.commit()
     
@@ -1124,21 +1221,21 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
         try:
             c.execute("SELECT COUNT(*) FROM entities")
             count = c.fetchone()[0]
-            print(f"Total entities in GPKG: {count}")
+            log.info("Total entities in GPKG: %s", count)
             if count == 0:
-                print("Warning: No entities found in converted GPKG!")
+                log.warning("No entities found in converted GPKG!")
         except: pass
 
         conn.close()
     except Exception as e:
-        print(f"Post-processing error: {e}")
+        log.warning("Post-processing error: %s", e)
     
     # Sanitize coordinates (remove garbage)
     if progress_callback: progress_callback(85, "正在清理坐标...")
     try:
         sanitize_coordinates(gpkg_path)
     except Exception as e:
-        print(f"Sanitization warning: {e}")
+        log.warning("Sanitization warning: %s", e)
 
     # Normalize coordinates (optional - disabled to preserve original DWG coordinates)
     # if progress_callback: progress_callback(90, "正在归一化坐标...")
@@ -1153,22 +1250,86 @@ def convert_dwg_to_gpkg(dwg_path: Path, output_dir: Path, progress_callback=None
         if progress_callback: progress_callback(95, "正在重新打包GeoPackage...")
         repack_gpkg(gpkg_path)
     except Exception as e:
-        print(f"Repack warning: {e}")
+        log.warning("Repack warning: %s", e)
+
+    # Index for the per-layer color aggregation in get_gpkg_layers (after repack, which rebuilds the table)
+    ensure_layer_index(gpkg_path)
 
     if progress_callback: progress_callback(100, "转换完成")
     return True, gpkg_path, ""
 
-def check_gpkg_count(gpkg_path: Path) -> int:
+@contextmanager
+def _ro_conn(gpkg_path: Path):
+    """Short-lived read-only connection on a GPKG, closed on exit.
+
+    Opened per call (not cached or shared): this process rewrites GPKGs in place, and a handle
+    that outlives the call would also keep the file locked on Windows.
+    """
+    conn = sqlite3.connect(f"{Path(gpkg_path).resolve().as_uri()}?mode=ro", uri=True)
     try:
-        conn = sqlite3.connect(gpkg_path)
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM entities")
-        count = c.fetchone()[0]
+        conn.executescript("""
+            PRAGMA query_only=1;
+            PRAGMA cache_size=-20000;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+        """)
+        yield conn
+    finally:
         conn.close()
-        return count
+
+def check_gpkg_count(gpkg_path: Path) -> int:
+    try:
+        with _ro_conn(gpkg_path) as conn:
+            # GDAL keeps a trigger-maintained feature count; only scan the table if it is missing/unknown
+            try:
+                row = conn.execute(
+                    "SELECT feature_count FROM gpkg_ogr_contents WHERE table_name = 'entities'").fetchone()
+                if row and row[0] is not None and row[0] >= 0:
+                    return row[0]
+            except sqlite3.Error:
+                pass
+            c = conn.execute("SELECT COUNT(*) FROM entities")
+            return c.fetchone()[0]
     except:
         return 0
 
+@contextmanager
+def _gpkg_conn(gpkg_path: Path):
+    """Open a read/write SQLite connection on a GPKG (with SpatiaLite stubs for GDAL triggers)"""
+    conn = sqlite3.connect(gpkg_path)
+    try:
+        # GDAL's rtree/geometry triggers reference SpatiaLite functions
+        conn.create_function("ST_IsEmpty", 1, lambda *args: 0)
+        conn.create_function("ST_MinX", 1, lambda *args: 0.0)
+        conn.create_function("ST_MaxX", 1, lambda *args: 0.0)
+        conn.create_function("ST_MinY", 1, lambda *args: 0.0)
+        conn.create_function("ST_MaxY", 1, lambda *args: 0.0)
+        conn.create_function("ST_GeometryType", 1, lambda *args: "")
+        yield conn
+    finally:
+        conn.close()
+
+def _replace_file(src: Path, dst: Path) -> bool:
+    """Atomically replace dst with src (callers must have closed their SQLite handles)"""
+    # Windows: another process (e.g. AV scanner) may briefly hold the file; back off quickly
+    for delay in (0.01, 0.02, 0.05, 0.1, 0.2, None):
+        try:
+            os.replace(src, dst)
+            break
+        except PermissionError as e:
+            if delay is None:
+                log.warning("Could not replace %s: %s", dst.name, e)
+                return False
+            time.sleep(delay)
+    # Make the rename durable (POSIX only; directories cannot be opened on Windows)
+    try:
+        fd = os.open(dst.parent, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError:
+        pass
+    return True
+
 def repack_gpkg(gpkg_path: Path):
     """Repack GeoPackage to fix RTree and optimize"""
     temp_repacked = gpkg_path.parent / (gpkg_path.stem + "_repacked.gpkg")
@@ -1193,24 +1354,56 @@ def repack_gpkg(gpkg_path: Path):
     if ok and temp_repacked.exists():
         count = check_gpkg_count(temp_repacked)
         if count == 0:
-            print("Repack resulted in empty GPKG, keeping original.")
+            log.info("Repack resulted in empty GPKG, keeping original.")
             return False
 
-        for i in range(5):
-            try:
-                shutil.move(temp_repacked, gpkg_path)
-                return True
-            except Exception as e:
-                time.sleep(1)
-        print("Could not overwrite original GPKG after repack")
+        if _replace_file(temp_repacked, gpkg_path):
+            return True
+        log.warning("Could not overwrite original GPKG after repack")
     else:
-        print(f"Repack failed: {out}")
+        log.warning("Repack failed: %s", out)
     return False
 
 def sanitize_coordinates(gpkg_path: Path) -> bool:
-    """Filter out entities with extreme coordinates (likely garbage)"""
+    """Filter out entities with extreme coordinates (likely garbage).
+
+    NULL and empty geometries are dropped as well, on both paths, matching the
+    ST_MinX(geom) > ... filter of the ogr2ogr fallback.
+    """
     # 1e20 is large enough to cover the observable universe in meters, so anything larger is definitely garbage
     limit = 1e20 
+
+    # Fast path: delete outliers in place using the GPKG spatial index (no full copy)
+    try:
+        with _gpkg_conn(gpkg_path) as conn:
+            has_rtree = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='rtree_entities_geom'"
+            ).fetchone()
+            if has_rtree:
+                conn.execute("BEGIN IMMEDIATE")
+                # The rtree triggers skip NULL/empty geometries, so those are matched directly
+                # (empty = flags bit 4 of the GPKG header); NOT (...) also catches NaN bounds
+                cur = conn.execute(f"""
+                    DELETE FROM entities WHERE geom IS NULL
+                        OR substr(hex(substr(geom, 4, 1)), 1, 1) IN ('1','3','5','7','9','B','D','F')
+                        OR rowid IN (
+                            SELECT id FROM rtree_entities_geom
+                            WHERE NOT (minx > {-limit} AND maxx < {limit} AND miny > {-limit} AND maxy < {limit})
+                        )
+                """)
+                removed = cur.rowcount
+                remaining = conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+                if remaining == 0:
+                    conn.execute("ROLLBACK")
+                    log.info("Sanitization resulted in empty GPKG, keeping original.")
+                    return False
+                conn.execute("COMMIT")
+                if removed > 0:
+                    log.info("Removed %s entities with extreme coordinates", removed)
+                return True
+    except Exception as e:
+        log.warning("In-place sanitization failed, falling back to ogr2ogr: %s", e)
+
     temp_sane = gpkg_path.parent / (gpkg_path.stem + "_sane.gpkg")
     if temp_sane.exists():
         try: temp_sane.unlink()
@@ -1239,21 +1432,16 @@ def sanitize_coordinates(gpkg_path: Path) -> bool:
         # Replace original
         count = check_gpkg_count(temp_sane)
         if count == 0:
-            print("Sanitization resulted in empty GPKG, keeping original.")
+            log.info("Sanitization resulted in empty GPKG, keeping original.")
             return False
 
-        for i in range(5):
-            try:
-                shutil.move(temp_sane, gpkg_path)
-                return True
-            except Exception as e:
-                time.sleep(1)
-        else:
-             print("Could not overwrite original GPKG after sanitization")
-             return False
+        if _replace_file(temp_sane, gpkg_path):
+            return True
+        log.warning("Could not overwrite original GPKG after sanitization")
+        return False
     else:
         # If SQLite dialect fails, try fallback or just ignore
-        print(f"Sanitization failed (possibly no SpatiaLite): {out}")
+        log.warning("Sanitization failed (possibly no SpatiaLite): %s", out)
         return False
 
 def get_gpkg_bbox(gpkg_path: Path) -> tuple[bool, list[float] | None]:
@@ -1291,8 +1479,12 @@ def get_robust_bbox(gpkg_path: Path) -> tuple[float, float, float, float, float,
         if not ok or not csv_path.exists():
             return None
             
-        x_vals = []
-        y_vals = []
+        # One CSV row per entity: flat float64 arrays (2 values per row) instead of Python lists
+        # of float objects. Capacity doubles as rows are read, so the CSV alone decides the size
+        cap = 4096
+        x_vals = np.empty(2 * cap, dtype=np.float64)
+        y_vals = np.empty(2 * cap, dtype=np.float64)
+        i = 0
         
         try:
             with open(csv_path, "r", encoding="utf-8") as f:
@@ -1305,34 +1497,44 @@ def get_robust_bbox(gpkg_path: Path) -> tuple[float, float, float, float, float,
                             x2 = float(parts[1].strip('"'))
                             y1 = float(parts[2].strip('"'))
                             y2 = float(parts[3].strip('"'))
-                            x_vals.extend([x1, x2])
-                            y_vals.extend([y1, y2])
-                        except: pass
+                        except: continue
+                        if i == cap:
+                            cap *= 2
+                            x_vals = np.resize(x_vals, 2 * cap)
+                            y_vals = np.resize(y_vals, 2 * cap)
+                        x_vals[2 * i] = x1
+                        x_vals[2 * i + 1] = x2
+                        y_vals[2 * i] = y1
+                        y_vals[2 * i + 1] = y2
+                        i += 1
         except: pass
             
         if csv_path.exists(): 
             try: csv_path.unlink()
             except: pass
         
-        if not x_vals or not y_vals:
-            return None
-            
-        x_vals.sort()
-        y_vals.sort()
-        n = len(x_vals)
+        x_vals = x_vals[:2 * i]
+        y_vals = y_vals[:2 * i]
+        n = x_vals.size
         if n == 0: return None
         
+        p01 = int(n * 0.01)
         p10 = int(n * 0.1)
         p90 = int(n * 0.9)
-        rx1, rx2 = x_vals[p10], x_vals[p90]
-        ry1, ry2 = y_vals[p10], y_vals[p90]
+        p99 = int(n * 0.99)
+        
+        # Partial sort: only the four percentile positions need to be in place (O(N))
+        kth = [p01, p10, p90, p99]
+        x_vals.partition(kth)
+        y_vals.partition(kth)
+        
+        rx1, rx2 = float(x_vals[p10]), float(x_vals[p90])
+        ry1, ry2 = float(y_vals[p10]), float(y_vals[p90])
         robust_w = rx2 - rx1
         robust_h = ry2 - ry1
         
-        p01 = int(n * 0.01)
-        p99 = int(n * 0.99)
-        sx1, sx2 = x_vals[p01], x_vals[p99]
-        sy1, sy2 = y_vals[p01], y_vals[p99]
+        sx1, sx2 = float(x_vals[p01]), float(x_vals[p99])
+        sy1, sy2 = float(y_vals[p01]), float(y_vals[p99])
         
         if robust_w > 0 and (sx2 - sx1) > robust_w * 20:
             mid_x = (rx1 + rx2) / 2
@@ -1349,6 +1551,96 @@ def get_robust_bbox(gpkg_path: Path) -> tuple[float, float, float, float, float,
     except Exception:
         return None
 
+@functools.lru_cache(maxsize=32)
+def _build_cols_sql(cols: tuple, text_scale: float, geom_scale: float) -> str:
+    """Build the non-geometry SELECT list for the normalization SQL (memoized, deterministic)"""
+    other_cols_sql = []
+    for col in cols:
+        if col.lower() in ('geom', 'geometry'): continue
+        if col == 'text_size':
+            if text_scale != 1.0:
+                other_cols_sql.append(f"text_size * {text_scale} as text_size")
+            else:
+                other_cols_sql.append(f'"{col}"')
+        elif col == 'line_width' and geom_scale != 1.0:
+             # line_width is usually in 1/100mm (integer). 
+             # If we scale geometry, line_width should ideally remain as "print size".
+             # But if line_width was somehow in ground units, it should scale.
+             # DXF 370 is strictly 1/100mm. It should NOT be scaled if it represents print width.
+             # So we keep it as is.
+             other_cols_sql.append(f'"{col}"')
+        else:
+            other_cols_sql.append(f'"{col}"')
+    return ", ".join(other_cols_sql) if other_cols_sql else "*"
+
+
+# Source SRS for the normalization pass; the actual math lives in the -ct pipeline below
+_NORMALIZE_SRC_SRS = "+proj=merc +lat_ts=0 +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
+
+@functools.lru_cache(maxsize=32)
+def _normalize_pipeline(cx: float, cy: float, scale: float) -> str:
+    """PROJ pipeline: shift to (0,0), scale drawing units to meters, inverse Mercator -> EPSG:4326 (lat, lon)"""
+    return (
+        "+proj=pipeline"
+        f" +step +proj=affine +xoff={-cx * scale!r} +yoff={-cy * scale!r} +s11={scale!r} +s22={scale!r}"
+        " +step +inv +proj=merc +lat_ts=0 +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84"
+        " +step +proj=unitconvert +xy_in=rad +xy_out=deg"
+        " +step +proj=axisswap +order=2,1"
+    )
+
+
+# Above this many features the normalization pass is split into parallel fid ranges
+_PARALLEL_NORMALIZE_MIN_FEATURES = 500000
+
+def _run_fid_partitioned(gpkg_path: Path, out_path: Path, make_cmd, max_workers: int = 6) -> tuple[bool, str]:
+    """Run make_cmd(part_path, (fid_lo, fid_hi)) over N fid ranges in parallel, then append the parts into out_path"""
+    n = min(os.cpu_count() or 1, max_workers)
+    if n < 2:
+        return False, "single CPU"
+    try:
+        with _ro_conn(gpkg_path) as conn:
+            lo, hi = conn.execute("SELECT MIN(fid), MAX(fid) FROM entities").fetchone()
+    except Exception as e:
+        return False, f"fid range unavailable: {e}"
+    if lo is None:
+        return False, "empty table"
+
+    step = (hi - lo) // n + 1
+    ranges = [(lo + i * step, min(lo + (i + 1) * step - 1, hi)) for i in range(n)]
+    parts = [gpkg_path.parent / f"{gpkg_path.stem}_part{i}.gpkg" for i in range(n)]
+    for p in parts:
+        if p.exists():
+            try: p.unlink()
+            except: pass
+
+    try:
+        # Each ogr2ogr is its own process; the threads only wait on them. One PROJ thread per part.
+        with ThreadPoolExecutor(max_workers=n) as ex:
+            results = list(ex.map(
+                lambda pr: _run(make_cmd(pr[0], pr[1]), env={"GDAL_NUM_THREADS": "1"}),
+                zip(parts, ranges)))
+        for ok, out in results:
+            if not ok:
+                return False, out
+
+        # First part becomes the output, the others are appended to it
+        if not _replace_file(parts[0], out_path):
+            return False, f"could not move {parts[0].name}"
+        for p in parts[1:]:
+            if not p.exists():
+                continue
+            ok, out = _run([settings.ogr2ogr_cmd, *OGR_FAST_WRITE, "-f", "GPKG", "-update", "-append",
+                            "-nln", "entities", str(out_path), str(p)])
+            if not ok:
+                return False, out
+        return True, ""
+    finally:
+        for p in parts:
+            if p.exists():
+                try: p.unlink()
+                except: pass
+
+
 def normalize_coordinates(gpkg_path: Path) -> bool:
     """Check if coordinates are out of WGS84 bounds and shift to (0,0) if needed."""
     
@@ -1368,373 +1660,332 @@ def normalize_coordinates(gpkg_path: Path) -> bool:
         # Use center of Safe Bounds (clamped) as the center
         cx = (sx1 + sx2) / 2
         cy = (sy1 + sy2) / 2
-        print(f"Robust Stats: W={robust_w:.2f}, H={robust_h:.2f}, Center=({cx:.2f}, {cy:.2f})")
+        log.info("Robust Stats: W=%.2f, H=%.2f, Center=(%.2f, %.2f)", robust_w, robust_h, cx, cy)
 
     # If already normalized
     if -200 <= sx1 and sx2 <= 200 and -100 <= sy1 and sy2 <= 100:
         return True
         
-    print(f"Normalizing... Center:({cx:.2f},{cy:.2f})")
+    log.info("Normalizing... Center:(%.2f,%.2f)", cx, cy)
     
     scale_factor = 1.0
     # Determine scale factor based on ROBUST dimensions
     if robust_w > 20000000 or robust_h > 20000000:
         scale_factor = 0.001
-        print(f"Detected huge dimensions (Robust W:{robust_w:.0f}), scaling by 0.001...")
+        log.info("Detected huge dimensions (Robust W:%.0f), scaling by 0.001...", robust_w)
     
     # Check for Text Unit Mismatch (e.g. Geometry in Meters, Text in Millimeters)
+    # Column list is read once here and reused to build the SELECT below
     text_scale_factor = scale_factor
+    cols = []
     try:
-        conn = sqlite3.connect(gpkg_path)
-        c = conn.cursor()
-        c.execute("PRAGMA table_info(entities)")
-        cols_info = {r[1] for r in c.fetchall()}
-        
-        if 'text_size' in cols_info:
-            # Check Max Text Size
-            c.execute("SELECT MAX(text_size) FROM entities WHERE text_size IS NOT NULL")
-            row = c.fetchone()
-            max_text = float(row[0]) if row and row[0] is not None else 0.0
-
-            # Check Median Text Size (Approximation via middle row)
-            c.execute("SELECT COUNT(*) FROM entities WHERE text_size IS NOT NULL")
-            count_row = c.fetchone()
-            count = count_row[0] if count_row else 0
+        with _gpkg_conn(gpkg_path) as conn:
+            c = conn.cursor()
+            c.execute("PRAGMA table_info(entities)")
+            cols = [r[1] for r in c.fetchall()]
+            has_text_size = 'text_size' in cols
             
-            median_text = 0.0
-            if count > 0:
-                offset = count // 2
-                c.execute(f"SELECT text_size FROM entities WHERE text_size IS NOT NULL ORDER BY text_size LIMIT 1 OFFSET {offset}")
-                med_row = c.fetchone()
-                if med_row and med_row[0] is not None:
-                    median_text = float(med_row[0])
-
-            # Heuristic Logic
-            # 1. Median Text > 50: Strong indicator of unit mismatch (mm vs m).
-            # 2. Max Text > 50% of Width: Strong indicator of huge labels.
+            if has_text_size:
+                # Check Max Text Size
+                c.execute("SELECT MAX(text_size) FROM entities WHERE text_size IS NOT NULL")
+                row = c.fetchone()
+                max_text = float(row[0]) if row and row[0] is not None else 0.0
+
+                # Check Median Text Size (Approximation via middle row)
+                c.execute("SELECT COUNT(*) FROM entities WHERE text_size IS NOT NULL")
+                count_row = c.fetchone()
+                count = count_row[0] if count_row else 0
             
-            should_scale = False
-            reason = ""
+                median_text = 0.0
+                if count > 0:
+                    offset = count // 2
+                    c.execute(f"SELECT text_size FROM entities WHERE text_size IS NOT NULL ORDER BY text_size LIMIT 1 OFFSET {offset}")
+                    med_row = c.fetchone()
+                    if med_row and med_row[0] is not None:
+                        median_text = float(med_row[0])
+
+                # Heuristic Logic
+                # 1. Median Text > 50: Strong indicator of unit mismatch (mm vs m).
+                # 2. Max Text > 50% of Width: Strong indicator of huge labels.
+            
+                should_scale = False
+                reason = ""
 
-            if robust_w > 0:
-                ratio_max = (max_text * scale_factor) / (robust_w * scale_factor)
-                ratio_med = (median_text * scale_factor) / (robust_w * scale_factor)
+                if robust_w > 0:
+                    ratio_max = (max_text * scale_factor) / (robust_w * scale_factor)
+                    ratio_med = (median_text * scale_factor) / (robust_w * scale_factor)
                 
-                # Smart Heuristic Logic
-                # We want to distinguish between:
-                # 1. Unit Mismatch (e.g. 3000mm text -> 3m). Scaling is GOOD.
-                # 2. Big Text on Large Map (e.g. 300m text on 30km map). Scaling -> 0.3m (Invisible). Scaling is BAD.
-                # 3. Huge Text on Small Map (e.g. 300m text on 500m map). Scaling -> 0.3m (Tiny but better than covering map). Scaling is NECESSARY.
+                    # Smart Heuristic Logic
+                    # We want to distinguish between:
+                    # 1. Unit Mismatch (e.g. 3000mm text -> 3m). Scaling is GOOD.
+                    # 2. Big Text on Large Map (e.g. 300m text on 30km map). Scaling -> 0.3m (Invisible). Scaling is BAD.
+                    # 3. Huge Text on Small Map (e.g. 300m text on 500m map). Scaling -> 0.3m (Tiny but better than covering map). Scaling is NECESSARY.
                 
-                median_val = median_text * scale_factor
-                scaled_median = median_val * 0.001
-                max_val = max_text * scale_factor
+                    median_val = median_text * scale_factor
+                    scaled_median = median_val * 0.001
+                    max_val = max_text * scale_factor
                 
-                if robust_w > 0:
-                    ratio_median = median_val / robust_w
-                    ratio_max = max_val / robust_w
-                else:
-                    ratio_median = 0
-                    ratio_max = 0
+                    if robust_w > 0:
+                        ratio_median = median_val / robust_w
+                        ratio_max = max_val / robust_w
+                    else:
+                        ratio_median = 0
+                        ratio_max = 0
                 
-                # Only consider scaling if Median Text > 50 (Strong indicator of non-meter units like mm)
-                if median_val > 50:
-                    # Case A: Scaling results in a "Normal" size (>= 0.5m)
-                    # e.g. 5000 -> 5m. 600 -> 0.6m.
-                    # This confirms it was likely mm.
-                    if scaled_median >= 0.5:
-                        should_scale = True
-                        reason = f"Median ({median_val:.2f}) > 50 and Scaled ({scaled_median:.2f}m) is visible (>=0.5m)"
+                    # Only consider scaling if Median Text > 50 (Strong indicator of non-meter units like mm)
+                    if median_val > 50:
+                        # Case A: Scaling results in a "Normal" size (>= 0.5m)
+                        # e.g. 5000 -> 5m. 600 -> 0.6m.
+                        # This confirms it was likely mm.
+                        if scaled_median >= 0.5:
+                            should_scale = True
+                            reason = f"Median ({median_val:.2f}) > 50 and Scaled ({scaled_median:.2f}m) is visible (>=0.5m)"
                     
-                    # Case B: Scaling results in "Tiny" size (< 0.5m), BUT Original is "Huge" (> 10% of map)
-                    # e.g. 300 on 100m map. Ratio 3.0. Scaled 0.3m.
-                    # 0.3m is small, but 300m covers the map. We prefer small.
-                    elif ratio_median > 0.1:
-                        should_scale = True
-                        reason = f"Median ({median_val:.2f}) is Huge relative to map ({ratio_median:.1%}), despite becoming small ({scaled_median:.2f}m)"
+                        # Case B: Scaling results in "Tiny" size (< 0.5m), BUT Original is "Huge" (> 10% of map)
+                        # e.g. 300 on 100m map. Ratio 3.0. Scaled 0.3m.
+                        # 0.3m is small, but 300m covers the map. We prefer small.
+                        elif ratio_median > 0.1:
+                            should_scale = True
+                            reason = f"Median ({median_val:.2f}) is Huge relative to map ({ratio_median:.1%}), despite becoming small ({scaled_median:.2f}m)"
                         
-                    # Case C: Scaling results in "Tiny" size, AND Original is "Acceptable" (< 10% of map)
-                    # e.g. 300 on 30,000m map. Ratio 1%. Scaled 0.3m.
-                    # 300m text is big but readable. 0.3m is invisible.
-                    # We KEEP the original.
-                    else:
-                        should_scale = False
-                        print(f"Text scaling skipped: Median ({median_val:.2f}) would become invisible ({scaled_median:.2f}m) and fits map ({ratio_median:.1%}).")
+                        # Case C: Scaling results in "Tiny" size, AND Original is "Acceptable" (< 10% of map)
+                        # e.g. 300 on 30,000m map. Ratio 1%. Scaled 0.3m.
+                        # 300m text is big but readable. 0.3m is invisible.
+                        # We KEEP the original.
+                        else:
+                            should_scale = False
+                            log.info("Text scaling skipped: Median (%.2f) would become invisible (%.2fm) and fits map (%.1f%%).", median_val, scaled_median, ratio_median * 100)
                 
-                else:
-                    # Median <= 50. Likely Meters.
-                    # However, if Max Text is ABSURDLY huge (e.g. > 80% of map), it's likely an outlier or unit mismatch affecting titles.
-                    # e.g. Map width 100m. Title "System Diagram" is 300 units (300mm -> 0.3m).
-                    # Interpreted as 300m. Covers map 3x.
-                    if ratio_max > 0.8:
-                         should_scale = True
-                         reason = f"Max Text ({max_val:.2f}) covers map ({ratio_max:.1%}) -> Forced Scale"
                     else:
-                         should_scale = False
+                        # Median <= 50. Likely Meters.
+                        # However, if Max Text is ABSURDLY huge (e.g. > 80% of map), it's likely an outlier or unit mismatch affecting titles.
+                        # e.g. Map width 100m. Title "System Diagram" is 300 units (300mm -> 0.3m).
+                        # Interpreted as 300m. Covers map 3x.
+                        if ratio_max > 0.8:
+                             should_scale = True
+                             reason = f"Max Text ({max_val:.2f}) covers map ({ratio_max:.1%}) -> Forced Scale"
+                        else:
+                             should_scale = False
 
-                if should_scale:
-                    proposed_scale = scale_factor * 0.001
+                    if should_scale:
+                        proposed_scale = scale_factor * 0.001
                     
-                    # Safeguard: Don't scale if result becomes invisible (< 0.05m = 5cm)
-                    # Unless original was truly huge (> 50m/units) which implies it MUST be scaled
-                    # If text is 80 (mm) -> 0.08m (8cm). OK.
-                    # If text is 20 (m) -> 0.02m (2cm). Too small? 
-                    # But 20m text is huge. If we scale 20 -> 0.02, it disappears.
-                    # If we don't scale 20 -> 20m. It covers map.
-                    # So if text > 50, we assume mm.
-                    # If text < 50, we rely on safeguard.
+                        # Safeguard: Don't scale if result becomes invisible (< 0.05m = 5cm)
+                        # Unless original was truly huge (> 50m/units) which implies it MUST be scaled
+                        # If text is 80 (mm) -> 0.08m (8cm). OK.
+                        # If text is 20 (m) -> 0.02m (2cm). Too small? 
+                        # But 20m text is huge. If we scale 20 -> 0.02, it disappears.
+                        # If we don't scale 20 -> 20m. It covers map.
+                        # So if text > 50, we assume mm.
+                        # If text < 50, we rely on safeguard.
                     
-                    # Check if SCALED median text would be at least 1cm (0.01m)
-                    # 10mm text -> 0.01m.
+                        # Check if SCALED median text would be at least 1cm (0.01m)
+                        # 10mm text -> 0.01m.
                     
-                    scaled_max = max_text * proposed_scale
+                        scaled_max = max_text * proposed_scale
                     
-                    if scaled_max < 0.01: # < 1cm
-                         print(f"Text scaling skipped: Resulting text too small (Max {scaled_max:.4f}m). Reason: {reason}")
-                    else:
-                         print(f"Detected text unit mismatch. {reason}. Scaling text by 0.001...")
-                         text_scale_factor = proposed_scale
+                        if scaled_max < 0.01: # < 1cm
+                             log.info("Text scaling skipped: Resulting text too small (Max %.4fm). Reason: %s", scaled_max, reason)
+                        else:
+                             log.info("Detected text unit mismatch. %s. Scaling text by 0.001...", reason)
+                             text_scale_factor = proposed_scale
 
-        conn.close()
     except Exception as e:
-        print(f"Error checking text size: {e}")
+        log.warning("Error checking text size: %s", e)
 
     # Get columns to avoid "geom, *" ambiguity and handle text scaling
     cols_str = "*"
     try:
-        conn = sqlite3.connect(gpkg_path)
-        c = conn.cursor()
-        c.execute("PRAGMA table_info(entities)")
-        cols = [r[1] for r in c.fetchall()]
-        conn.close()
-        
-        other_cols_sql = []
-        for col in cols:
-            if col.lower() in ('geom', 'geometry'): continue
-            if col == 'text_size':
-                if text_scale_factor != 1.0:
-                    other_cols_sql.append(f"text_size * {text_scale_factor} as text_size")
-                else:
-                    other_cols_sql.append(f'"{col}"')
-            elif col == 'line_width' and scale_factor != 1.0:
-                 # line_width is usually in 1/100mm (integer). 
-                 # If we scale geometry, line_width should ideally remain as "print size".
-                 # But if line_width was somehow in ground units, it should scale.
-                 # DXF 370 is strictly 1/100mm. It should NOT be scaled if it represents print width.
-                 # So we keep it as is.
-                 other_cols_sql.append(f'"{col}"')
-            else:
-                other_cols_sql.append(f'"{col}"')
-                
-        if other_cols_sql:
-            cols_str = ", ".join(other_cols_sql)
-            
+        if cols:
+            cols_str = _build_cols_sql(tuple(cols), text_scale_factor, scale_factor)
     except Exception as e:
-        print(f"Failed to get columns: {e}")
+        log.warning("Failed to get columns: %s", e)
     
-    temp_shifted = gpkg_path.parent / (gpkg_path.stem + "_shifted.gpkg")
+    # Single output file: shift + scale + reprojection happen in one pass, no intermediate GPKG.
+    # Kept as a sibling of the source so the final swap is a same-volume os.replace, never a copy.
     temp_final = gpkg_path.parent / (gpkg_path.stem + "_final.gpkg")
     
-    for p in [temp_shifted, temp_final]:
-        if p.exists():
-            try: p.unlink()
-            except: pass
+    if temp_final.exists():
+        try: temp_final.unlink()
+        except: pass
 
-    # Step 1: Shift to center (0,0) + Handle Scaling
-    # Instead of ST_Scale (which might be missing), we use SRS transformation trick
-    # We define Source SRS with units=mm if needed, and Target SRS with units=m
-    
-    # First, shift to center (0,0)
-    print(f"Shifting geometry by X:{-cx:.2f}, Y:{-cy:.2f} to center at (0,0)")
-    sql = f"SELECT ST_Translate(geom, {-cx}, {-cy}, 0) as geom, {cols_str} FROM entities"
-    
-    # If scaling is needed, we define a custom SRS for the shifted GPKG
-    # We use a Mercator projection centered at 0,0
-    # If scale_factor is 0.001 (mm), we set units=mm
-    # If scale_factor is 1.0 (m), we set units=m
-    
-    src_proj = "+proj=merc +lat_ts=0 +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
-    if scale_factor == 0.001:
-        # Use +to_meter=0.001 to explicitly define units as millimeters
-        # +units=mm might be ignored or not supported in all PROJ versions for Mercator
-        src_proj = "+proj=merc +lat_ts=0 +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +to_meter=0.001 +no_defs"
+    # Shift to center (0,0) + Handle Scaling + Reproject to EPSG:4326 in ONE ogr2ogr pass
+    # The shifted coordinates are interpreted as a Mercator projection centered at 0,0.
+    # If scale_factor is 0.001 (mm), the pipeline scales to meters before the inverse Mercator,
+    # so features are read once and written once (no intermediate shifted GPKG).
+    log.info("Shifting geometry by X:%.2f, Y:%.2f to center at (0,0)", -cx, -cy)
+    sql = f"SELECT geom, {cols_str} FROM entities"
+    pipeline = _normalize_pipeline(cx, cy, scale_factor)
     
     # Get original count for comparison
     original_count = check_gpkg_count(gpkg_path)
 
-    cmd_shift = [settings.ogr2ogr_cmd, "-f", "GPKG"]
-    
-    # Add spatial filter if we have robust bounds to clip outliers
-    # MUST be placed before source/dest in some versions, or at least before -sql depending on driver
-    if stats:
-        # Use formatted strings to ensure valid float representation
-        cmd_shift.extend(["-spat", f"{sx1:.4f}", f"{sy1:.4f}", f"{sx2:.4f}", f"{sy2:.4f}"])
-
-    cmd_shift.extend([
-        "-dialect", "SQLite",
-        "-sql", sql,
-        "-nln", "entities",
-        "-a_srs", src_proj, # Assign the custom SRS to the shifted data
-        "-lco", "GEOMETRY_NAME=geom",
-        "-nlt", "GEOMETRY",
-        "-dim", "XY",
-        str(temp_shifted),
-        str(gpkg_path)
-    ])
-    
-    print(f"Running normalization command: {' '.join(cmd_shift)}")
-    
-    ok_shift, out_shift = _run(cmd_shift)
+    def _normalize_cmd(spat: bool, out: Path = temp_final, fid_range: tuple[int, int] | None = None) -> list[str]:
+        cmd = [settings.ogr2ogr_cmd, *OGR_FAST_WRITE, "-f", "GPKG"]
+        # Add spatial filter if we have robust bounds to clip outliers
+        # MUST be placed before source/dest in some versions, or at least before -sql depending on driver
+        if spat:
+            # Use formatted strings to ensure valid float representation
+            cmd.extend(["-spat", f"{sx1:.4f}", f"{sy1:.4f}", f"{sx2:.4f}", f"{sy2:.4f}"])
+        cmd.extend([
+            "-dialect", "SQLite",
+            "-sql", sql if fid_range is None else f"{sql} WHERE fid BETWEEN {fid_range[0]} AND {fid_range[1]}",
+            "-nln", "entities",
+            "-s_srs", _NORMALIZE_SRC_SRS,
+            "-t_srs", "EPSG:4326",
+            "-ct", pipeline,
+            "-lco", "GEOMETRY_NAME=geom",
+            "-nlt", "GEOMETRY",
+            "-dim", "XY",
+            str(out),
+            str(gpkg_path)
+        ])
+        return cmd
+
+    def _run_normalize(spat: bool) -> tuple[bool, str]:
+        # Large drawings: PROJ transforms are embarrassingly parallel, split by fid range
+        if original_count > _PARALLEL_NORMALIZE_MIN_FEATURES:
+            ok, out = _run_fid_partitioned(gpkg_path, temp_final, lambda out, rng: _normalize_cmd(spat, out, rng))
+            if ok:
+                return ok, out
+            log.warning("Parallel normalization failed, running single pass: %s", out)
+            if temp_final.exists():
+                try: temp_final.unlink()
+                except: pass
+        cmd_norm = _normalize_cmd(spat)
+        log.info("Running normalization command: %s", ' '.join(cmd_norm))
+        return _run(cmd_norm, env=ENV_REPROJECT)
+
+    ok_norm, out_norm = _run_normalize(bool(stats))
     
-    # Check if shift produced a valid file
-    shift_success = False
-    if ok_shift and temp_shifted.exists():
-        filtered_count = check_gpkg_count(temp_shifted)
+    # Check if normalization produced a valid file
+    norm_success = False
+    if ok_norm and temp_final.exists():
+        filtered_count = check_gpkg_count(temp_final)
         
         # Check if we lost too many entities due to spatial filtering
         # If we kept < 20% of entities AND kept < 2000 entities, assume filtering was too aggressive
         ratio = filtered_count / original_count if original_count > 0 else 0
         
         if filtered_count > 0 and (ratio > 0.2 or filtered_count > 2000):
-            shift_success = True
+            norm_success = True
         else:
-            print(f"Normalization (Shift+Filter) kept only {filtered_count}/{original_count} entities ({ratio:.1%}). Retrying without spatial filter...")
+            log.info("Normalization (Shift+Filter) kept only %s/%s entities (%.1f%%). Retrying without spatial filter...", filtered_count, original_count, ratio * 100)
     
     # Retry without spatial filter if first attempt failed or was too aggressive
-    if not shift_success and stats:
-        print("Retrying normalization WITHOUT spatial filter...")
-        cmd_shift_retry = [settings.ogr2ogr_cmd, "-f", "GPKG"]
-        cmd_shift_retry.extend([
-            "-dialect", "SQLite",
-            "-sql", sql,
-            "-nln", "entities",
-            "-a_srs", src_proj,
-            "-lco", "GEOMETRY_NAME=geom",
-            "-nlt", "GEOMETRY",
-            "-dim", "XY",
-            str(temp_shifted),
-            str(gpkg_path)
-        ])
-        ok_shift, out_shift = _run(cmd_shift_retry)
-        if ok_shift and temp_shifted.exists() and check_gpkg_count(temp_shifted) > 0:
-            shift_success = True
+    if not norm_success and stats:
+        log.info("Retrying normalization WITHOUT spatial filter...")
+        if temp_final.exists():
+            try: temp_final.unlink()
+            except: pass
+        ok_norm, out_norm = _run_normalize(False)
+        if ok_norm and temp_final.exists() and check_gpkg_count(temp_final) > 0:
+            norm_success = True
         else:
-            print(f"Retry failed: {out_shift}")
+            log.warning("Retry failed: %s", out_norm)
 
     result_gpkg = None
     
-    if shift_success:
-        # Step 2: Reproject to EPSG:4326 (WGS84)
-        # This will automatically handle the unit conversion (mm -> m/degrees)
-        # because temp_shifted has units=mm defined in its SRS
-        cmd_proj = [
-            settings.ogr2ogr_cmd,
-            "-f", "GPKG",
-            str(temp_final),
-            str(temp_shifted),
-            "-t_srs", "EPSG:4326"
-        ]
-        ok_proj, out_proj = _run(cmd_proj)
-        if ok_proj:
-            result_gpkg = temp_final
-        else:
-            print(f"Normalization (Project) failed: {out_proj}")
+    if norm_success:
+        result_gpkg = temp_final
     else:
-        print(f"Normalization (Shift) failed: {out_shift}")
+        log.warning("Normalization (Shift+Project) failed: %s", out_norm)
+        if temp_final.exists():
+            try: temp_final.unlink()
+            except: pass
         # Fallback: Direct project without shift (assume coordinates are valid 3857)
-        print("Attempting fallback: Project 3857->4326 without shift...")
+        log.info("Attempting fallback: Project 3857->4326 without shift...")
         cmd_fallback = [
             settings.ogr2ogr_cmd,
+            *OGR_FAST_WRITE,
             "-f", "GPKG",
             str(temp_final),
             str(gpkg_path),
             "-s_srs", "EPSG:3857",
             "-t_srs", "EPSG:4326"
         ]
-        ok_fb, out_fb = _run(cmd_fallback)
+        ok_fb, out_fb = _run(cmd_fallback, env=ENV_REPROJECT)
         if ok_fb:
             result_gpkg = temp_final
         else:
-            print(f"Fallback failed: {out_fb}")
+            log.warning("Fallback failed: %s", out_fb)
 
     if result_gpkg and result_gpkg.exists():
         count = check_gpkg_count(result_gpkg)
         if count == 0:
-            print("Normalization resulted in empty GPKG, keeping original.")
+            log.info("Normalization resulted in empty GPKG, keeping original.")
             return False
 
         # Replace original
-        for i in range(5):
-            try:
-                shutil.move(result_gpkg, gpkg_path)
-                break
-            except Exception as e:
-                print(f"Overwrite retry {i}: {e}")
-                time.sleep(1)
-        else:
-             print("Could not overwrite original GPKG")
+        if not _replace_file(result_gpkg, gpkg_path):
+             log.warning("Could not overwrite original GPKG")
              return False
-        
-        # Cleanup
-        if temp_shifted.exists():
-            try: temp_shifted.unlink()
-            except: pass
         return True
     
     return False
 
-def get_gpkg_layers(gpkg_path: Path) -> list[dict]:
-    """Extract distinct layer names and their representative colors from the GPKG entities table."""
+def ensure_layer_index(gpkg_path: Path):
+    """Create the (Layer, line_color) index used by get_gpkg_layers and refresh planner stats, once per GPKG"""
     try:
-        conn = sqlite3.connect(gpkg_path)
+        with _gpkg_conn(gpkg_path) as conn:
+            c = conn.cursor()
+            c.execute("PRAGMA index_list(entities)")
+            if any(r[1] == 'idx_entities_layer_color' for r in c.fetchall()):
+                return
+            c.execute("PRAGMA table_info(entities)")
+            cols = {r[1] for r in c.fetchall()}
+            if 'Layer' not in cols or 'line_color' not in cols:
+                return
+            c.execute("CREATE INDEX IF NOT EXISTS idx_entities_layer_color ON entities(Layer, line_color)")
+            c.execute("ANALYZE entities")
+            conn.commit()
+    except Exception as e:
+        log.warning("Layer index warning: %s", e)
+
+@functools.lru_cache(maxsize=64)
+def _layers_cached(path_str: str, mtime_ns: int, size: int) -> tuple[LayerInfo, ...]:
+    """Layer list for one version of a GPKG; (mtime_ns, size) in the key invalidates it when the file is replaced"""
+    with _ro_conn(Path(path_str)) as conn:
         c = conn.cursor()
-        
-        # Check if Layer column exists
-        c.execute("PRAGMA table_info(entities)")
-        cols = [r[1] for r in c.fetchall()]
-        
+
+        # Check if Layer / line_color columns exist
+        cols = {r[0] for r in c.execute(
+            "SELECT name FROM pragma_table_info('entities') WHERE name IN ('Layer', 'line_color')")}
+
         if 'Layer' not in cols:
-            conn.close()
-            return []
-            
-            
-        # 1. Get all layers
-        c.execute("SELECT DISTINCT Layer FROM entities WHERE Layer IS NOT NULL ORDER BY Layer")
-        all_layers = [row[0] for row in c.fetchall()]
-        
-        # 2. Get representative color for each layer (most frequent line_color)
-        layer_colors = {}
+            return ()
+
+        # All layers plus their representative color (most frequent line_color) in one query and one
+        # pass over idx_entities_layer_color: NULL colors rank last, so a layer only gets NULL (-> default)
+        # when it has no color at all; ties on the count resolve to the lowest color string
         if 'line_color' in cols:
-            try:
-                c.execute("""
-                    SELECT Layer, line_color, COUNT(*) as cnt 
-                    FROM entities 
-                    WHERE Layer IS NOT NULL AND line_color IS NOT NULL 
+            c.execute("""
+                SELECT Layer, line_color FROM (
+                    SELECT Layer, line_color,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY Layer
+                               ORDER BY line_color IS NULL, COUNT(*) DESC, line_color
+                           ) AS rn
+                    FROM entities
+                    WHERE Layer IS NOT NULL
                     GROUP BY Layer, line_color
-                """)
-                # Process to find max count per layer
-                temp_counts = {}
-                for row in c.fetchall():
-                    layer, color, count = row
-                    if layer not in temp_counts:
-                        temp_counts[layer] = []
-                    temp_counts[layer].append((color, count))
-                
-                for layer, counts in temp_counts.items():
-                    # Sort by count desc
-                    counts.sort(key=lambda x: x[1], reverse=True)
-                    layer_colors[layer] = counts[0][0]
-            except Exception as e:
-                print(f"Error extracting colors: {e}")
+                )
+                WHERE rn = 1
+                ORDER BY Layer
+            """)
+        else:
+            c.execute("SELECT DISTINCT Layer, NULL FROM entities WHERE Layer IS NOT NULL ORDER BY Layer")
 
-        result = []
-        for layer in all_layers:
-            # Default to a generic color if not found
-            color = layer_colors.get(layer, "#9ca3af") 
-            result.append({"name": layer, "color": color})
-            
-        conn.close()
-        return result
+        # Default to a generic color if not found
+        return tuple(LayerInfo(layer, color or "#9ca3af") for layer, color in c)
+
+def get_gpkg_layers(gpkg_path: Path) -> list[LayerInfo]:
+    """Extract distinct layer names and their representative colors from the GPKG entities table."""
+    try:
+        path = Path(gpkg_path).resolve()
+        st = path.stat()
+        # LayerInfo is immutable, so the cached entries can be handed out directly
+        return list(_layers_cached(str(path), st.st_mtime_ns, st.st_size))
     except Exception as e:
-        print(f"Error getting layers: {e}")
+        log.warning("Error getting layers: %s", e)
         return []
@@ -1,23 +1,175 @@
 # -*- coding: utf-8 -*-
 """通过 GeoServer REST API 发布 GeoPackage 为 MVT/WMTS 图层"""
-import base64
+import atexit
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
+from urllib.parse import quote
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, unescape
 
 import httpx
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:  # 可选依赖，缺失时退回标准库
+    import json
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 from app.config import settings
 
+log = logging.getLogger(__name__)
+
+# 进程内共享的 GeoServer 连接（keep-alive，复用 TCP 连接）
+_client: httpx.Client | None = None
+_client_lock = threading.Lock()
+# 相互独立的 REST 预检在此线程池中并发发出（共享同一个连接池）；与 _client 一样按需创建，close_client 后可重建
+_probe_pool: ThreadPoolExecutor | None = None
+
+
+_RETRY_STATUS = (429, 503)
+_MAX_RETRIES = 3
+_MAX_RETRY_DELAY = 10.0
+
+
+def _retry_delay(r: httpx.Response, attempt: int) -> float:
+    """Honor a numeric Retry-After, else exponential backoff (0.5s, 1s, 2s ...)"""
+    retry_after = r.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), _MAX_RETRY_DELAY)
+    return min(0.5 * (2 ** attempt), _MAX_RETRY_DELAY)
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body stream that gives the concurrency permit back when the body is closed"""
+
+    def __init__(self, stream: httpx.SyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class _GatedTransport(httpx.BaseTransport):
+    """Caps in-flight GeoServer requests with a semaphore and retries 429/503"""
+
+    def __init__(self, transport: httpx.BaseTransport, max_concurrency: int):
+        self._transport = transport
+        self._sem = threading.BoundedSemaphore(max_concurrency)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            self._sem.acquire()
+            try:
+                r = self._transport.handle_request(request)
+            except BaseException:
+                self._sem.release()
+                raise
+            if r.status_code not in _RETRY_STATUS or attempt >= _MAX_RETRIES:
+                # 许可随响应正文一起释放：普通请求读完正文即关闭，client.stream() 在退出上下文时关闭，
+                # 因此流式读取仍然是逐块的，连接释放后才让出并发名额
+                r.stream = _ReleasingStream(r.stream, self._sem.release)
+                return r
+            try:
+                r.close()
+            finally:
+                self._sem.release()
+            # 退避期间不占用许可
+            time.sleep(_retry_delay(r, attempt))
+            attempt += 1
+
+    def close(self) -> None:
+        self._transport.close()
+
 
-def _auth_headers() -> dict:
-    raw = f"{settings.geoserver_user}:{settings.geoserver_password}"
-    token = base64.b64encode(raw.encode()).decode()
-    return {"Authorization": f"Basic {token}"}
+def _get_client() -> httpx.Client:
+    """Shared keep-alive client; base_url is the GeoServer root, auth is preset"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                max_concurrency = settings.geoserver_max_concurrency or min(8, (os.cpu_count() or 1) * 2)
+                # Limits 作为第二道上限：连接数不超过并发许可数
+                limits = httpx.Limits(
+                    max_keepalive_connections=min(16, max_concurrency),
+                    max_connections=max_concurrency,
+                    keepalive_expiry=60,
+                )
+                _client = httpx.Client(
+                    base_url=settings.geoserver_url.rstrip("/"),
+                    auth=(settings.geoserver_user, settings.geoserver_password),
+                    timeout=30.0,
+                    transport=_GatedTransport(httpx.HTTPTransport(limits=limits), max_concurrency),
+                    headers={"Accept": "application/json"},
+                )
+                atexit.register(close_client)
+    return _client
+
+
+def _get_probe_pool() -> ThreadPoolExecutor:
+    """Shared pool for concurrent REST probes; recreated on demand after close_client()"""
+    global _probe_pool
+    if _probe_pool is None:
+        with _client_lock:
+            if _probe_pool is None:
+                _probe_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="geoserver-probe")
+    return _probe_pool
+
+
+def _json(r: httpx.Response):
+    """Decode a REST response body straight from bytes (orjson when installed)"""
+    return _json_loads(r.content)
+
+
+_JSON_CONTENT_HEADERS = MappingProxyType({"Content-Type": "application/json"})
+
+
+def close_client() -> None:
+    """关闭共享连接池与预检线程池（应用关闭时调用，可重复调用）"""
+    global _client, _probe_pool
+    with _client_lock:
+        client, _client = _client, None
+        pool, _probe_pool = _probe_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+    if client is not None:
+        client.close()
 
 
 def _rest(url_path: str) -> str:
-    base = settings.geoserver_url.rstrip("/")
-    return f"{base}/rest/{url_path}"
+    """Relative REST path for the shared client.
+
+    Pass workspace-scoped paths (``workspaces/{ws}/...``) wherever GeoServer offers one; global
+    listings such as ``styles.json`` or ``layers.json`` go through the slower global dispatcher.
+    Existence probes should also send ``params=_QUIET_404`` so a miss skips error-page rendering.
+    """
+    return "rest/" + url_path
+
+
+# 共享的请求参数/头为只读映射，避免某个调用方意外修改
+_QUIET_404 = MappingProxyType({"quietOnNotFound": "true"})
 
 
 DWG_SLD = """<?xml version="1.0" encoding="ISO-8859-1"?>
@@ -220,6 +372,18 @@ DWG_SLD = """<?xml version="1.0" encoding="ISO-8859-1"?>
   </NamedLayer>
 </StyledLayerDescriptor>
 """
+# 请求体在导入时编码一次（XML 声明为 ISO-8859-1）
+DWG_SLD_BYTES = DWG_SLD.encode("iso-8859-1")
+
+
+def _sld_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+_SLD_HASH = _sld_digest(DWG_SLD_BYTES)
+# SLD 上传/下载所用请求头（模块级常量，避免每次调用重建）
+_SLD_CONTENT_HEADERS = MappingProxyType({"Content-Type": "application/vnd.ogc.sld+xml"})
+_SLD_ACCEPT_HEADERS = MappingProxyType({"Accept": "application/vnd.ogc.sld+xml"})
 
 DWG_RASTER_SLD = """<?xml version="1.0" encoding="ISO-8859-1"?>
 <StyledLayerDescriptor version="1.0.0" 
@@ -429,186 +593,255 @@ DWG_RASTER_SLD = """<?xml version="1.0" encoding="ISO-8859-1"?>
   </NamedLayer>
 </StyledLayerDescriptor>
 """
+DWG_RASTER_SLD_BYTES = DWG_RASTER_SLD.encode("iso-8859-1")
+_RASTER_SLD_HASH = _sld_digest(DWG_RASTER_SLD_BYTES)
+
+# 已确认存在的 workspace / 样式（进程生命周期内缓存，避免每次发布重复 GET+PUT）
+_ws_ready: set[str] = set()
+_style_ready: set[tuple[str, str]] = set()
+# _ready_lock 只保护上面两个集合与 _key_locks 字典本身；GeoServer 往返在各 key 自己的锁里进行
+_ready_lock = threading.Lock()
+_key_locks: dict = {}
+
 
-def ensure_dwg_style() -> tuple[bool, str]:
+def _invalidate_style_cache() -> None:
+    """Forget cached workspace/style checks (e.g. after styles were edited or GeoServer was reset)"""
+    with _ready_lock:
+        _ws_ready.clear()
+        _style_ready.clear()
+
+
+@lru_cache(maxsize=4096)
+def workspace_for(layer_name: str) -> str:
+    """图层所属 workspace：geoserver_workspace_shards > 1 时按图层名哈希分片到 {ws}_{n}"""
+    shards = settings.geoserver_workspace_shards
+    if shards <= 1:
+        return settings.geoserver_workspace
+    n = int.from_bytes(hashlib.blake2s(layer_name.encode("utf-8"), digest_size=4).digest(), "big") % shards
+    return f"{settings.geoserver_workspace}_{n}"
+
+
+def _ensure_cached(ready: set, key, ensure) -> tuple[bool, str]:
+    """Run ensure() once per key; concurrent callers of the same key wait instead of issuing duplicate PUTs,
+    other keys (workspaces / styles) proceed in parallel"""
+    if key in ready:
+        return True, ""
+    with _ready_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        if key in ready:
+            return True, ""
+        ok, msg = ensure()
+        if ok:
+            with _ready_lock:
+                ready.add(key)
+        return ok, msg
+
+
+def ensure_dwg_style(ws: str | None = None) -> tuple[bool, str]:
     """Ensure dwg_generic_style exists"""
+    ws = ws or settings.geoserver_workspace
+    return _ensure_cached(_style_ready, (ws, "dwg_generic_style"), partial(_ensure_dwg_style, ws))
+
+
+def _ensure_dwg_style(ws: str) -> tuple[bool, str]:
     try:
         style_name = "dwg_generic_style"
-        ws = settings.geoserver_workspace
-        base = settings.geoserver_url.rstrip("/")
-        # Check if style exists in workspace
-        url = f"{base}/rest/workspaces/{ws}/styles/{style_name}.json"
+        # Check if style exists in workspace, fetching the stored SLD itself
+        url = _rest(f"workspaces/{ws}/styles/{style_name}.sld")
         
-        with httpx.Client(timeout=30.0) as client:
-            h_sld = {**_auth_headers(), "Content-Type": "application/vnd.ogc.sld+xml"}
-            
-            r = client.get(url, headers=_auth_headers())
-            if r.status_code == 200:
-                # Update it to ensure latest SLD
-                client.put(
-                    f"{base}/rest/workspaces/{ws}/styles/{style_name}",
-                    headers=h_sld,
-                    content=DWG_SLD
-                )
+        client = _get_client()
+        r = client.get(url, params=_QUIET_404, headers=_SLD_ACCEPT_HEADERS)
+        if r.status_code == 200:
+            # Unchanged SLD: skip the PUT (which would also reset GeoServer's parsed-style cache)
+            if _sld_digest(r.content) == _SLD_HASH:
                 return True, ""
-                
-            # Create style
-            create_url = f"{base}/rest/workspaces/{ws}/styles"
-            r2 = client.post(
-                create_url, 
-                params={"name": style_name},
-                headers=h_sld,
-                content=DWG_SLD
+            # Update it to ensure latest SLD (raw=true stores the bytes verbatim so the hash matches next time)
+            client.put(
+                _rest(f"workspaces/{ws}/styles/{style_name}"),
+                params={"raw": "true"},
+                headers=_SLD_CONTENT_HEADERS,
+                content=DWG_SLD_BYTES
             )
+            return True, ""
             
-            if r2.status_code in (200, 201):
-                return True, ""
-            return False, f"Create style failed: {r2.status_code} {r2.text[:200]}"
+        # Create style
+        create_url = _rest(f"workspaces/{ws}/styles")
+        r2 = client.post(
+            create_url, 
+            params={"name": style_name},
+            headers=_SLD_CONTENT_HEADERS,
+            content=DWG_SLD_BYTES
+        )
+        
+        if r2.status_code in (200, 201):
+            return True, ""
+        return False, f"Create style failed: {r2.status_code} {r2.text[:200]}"
             
     except Exception as e:
         return False, str(e)
 
 
-def ensure_workspace() -> tuple[bool, str]:
-    """创建 workspace 若不存在"""
+def ensure_workspace(ws: str | None = None) -> tuple[bool, str]:
+    """创建 workspace 若不存在（默认 settings.geoserver_workspace；分片时传入 workspace_for(layer_name)）"""
+    ws = ws or settings.geoserver_workspace
+    return _ensure_cached(_ws_ready, ws, partial(_ensure_workspace, ws))
+
+
+def _ensure_workspace(ws: str) -> tuple[bool, str]:
     try:
-        url = _rest(f"workspaces/{settings.geoserver_workspace}.json")
-        with httpx.Client(timeout=30.0) as client:
-            r = client.get(url, headers=_auth_headers())
-            if r.status_code == 200:
-                return True, ""
-            if r.status_code != 404:
-                return False, f"检查 workspace 失败: {r.status_code} {r.text[:200]}"
-            create_url = _rest("workspaces")
-            body = {"workspace": {"name": settings.geoserver_workspace}}
-            r2 = client.post(create_url, headers={**_auth_headers(), "Content-Type": "application/json"}, json=body)
-            if r2.status_code not in (200, 201):
-                return False, f"创建 workspace 失败: {r2.status_code} {r2.text[:200]}"
+        url = _rest(f"workspaces/{ws}.json")
+        client = _get_client()
+        r = client.head(url, params=_QUIET_404)
+        if r.status_code == 200:
+            return True, ""
+        if r.status_code != 404:
+            return False, f"检查 workspace 失败: {r.status_code}"
+        create_url = _rest("workspaces")
+        body = {"workspace": {"name": ws}}
+        r2 = client.post(create_url, json=body)
+        if r2.status_code not in (200, 201):
+            return False, f"创建 workspace 失败: {r2.status_code} {r2.text[:200]}"
         return True, ""
     except Exception as e:
         return False, str(e)
 
 
-def truncate_gwc_layer(layer_name: str) -> tuple[bool, str]:
+def truncate_gwc_layer(layer_name: str, ws: str | None = None) -> tuple[bool, str]:
     """Force clean GWC cache for a layer"""
-    try:
-        ws = settings.geoserver_workspace
-        full_layer_name = f"{ws}:{layer_name}"
-        base = settings.geoserver_url.rstrip("/")
-        # Using masstruncate API
-        url = f"{base}/gwc/rest/masstruncate"
-        
-        # Use ElementTree for safe XML construction
-        root = ET.Element("truncateLayer")
-        ET.SubElement(root, "layerName").text = full_layer_name
-        body = ET.tostring(root, encoding="unicode")
-        
-        with httpx.Client(timeout=30.0) as client:
-            r = client.post(
+    return truncate_gwc_layers([layer_name], ws)
+
+
+def truncate_gwc_layers(layer_names: list[str], ws: str | None = None) -> tuple[bool, str]:
+    """Force clean GWC cache for several layers of one DWG over a single keep-alive connection.
+
+    GWC masstruncate accepts one truncateLayer per request, so the POSTs are sent back to back
+    rather than merged into one document.
+    """
+    # Using masstruncate API
+    url = "gwc/rest/masstruncate"
+    errors = []
+    for layer_name in layer_names:
+        full_layer_name = f"{ws or workspace_for(layer_name)}:{layer_name}"
+        try:
+            body = _TRUNCATE_TMPL.replace("__L__", escape(full_layer_name)).encode("utf-8")
+            r = _get_client().post(
                 url, 
-                headers={**_auth_headers(), "Content-Type": "application/xml"}, 
+                headers={"Content-Type": "application/xml"}, 
                 content=body
             )
-            if r.status_code == 200:
-                return True, ""
-            return False, f"Cache cleanup failed: {r.status_code}"
-    except Exception as e:
-        return False, str(e)
+            if r.status_code != 200:
+                errors.append(f"{layer_name}: Cache cleanup failed: {r.status_code}")
+        except Exception as e:
+            errors.append(f"{layer_name}: {e}")
+    if errors:
+        return False, "; ".join(errors)
+    return True, ""
+
+
+def _build_gwc_layer_xml_template() -> str:
+    """GWC layer config (MVT/PNG/JPEG, 900913 + 4326, STYLES filter) with __LAYER__/__WS__ placeholders"""
+    # Build XML using ElementTree for safety (once, at import)
+    root = ET.Element("GeoServerLayer")
+
+    ET.SubElement(root, "enabled").text = "true"
+    ET.SubElement(root, "inMemoryCached").text = "true"
+    ET.SubElement(root, "name").text = "__LAYER__"
+    ET.SubElement(root, "gutter").text = "100"
+
+    mime_formats = ET.SubElement(root, "mimeFormats")
+    for fmt in ["image/png", "image/jpeg", "application/vnd.mapbox-vector-tile"]:
+        ET.SubElement(mime_formats, "string").text = fmt
+
+    grid_subsets = ET.SubElement(root, "gridSubsets")
+
+    # EPSG:900913
+    gs_900913 = ET.SubElement(grid_subsets, "gridSubset")
+    ET.SubElement(gs_900913, "gridSetName").text = "EPSG:900913"
+    extent_900913 = ET.SubElement(gs_900913, "extent")
+    coords_900913 = ET.SubElement(extent_900913, "coords")
+    for val in ["-20037508.34", "-20037508.34", "20037508.34", "20037508.34"]:
+        ET.SubElement(coords_900913, "double").text = val
+
+    # EPSG:4326
+    gs_4326 = ET.SubElement(grid_subsets, "gridSubset")
+    ET.SubElement(gs_4326, "gridSetName").text = "EPSG:4326"
+    extent_4326 = ET.SubElement(gs_4326, "extent")
+    coords_4326 = ET.SubElement(extent_4326, "coords")
+    for val in ["-180.0", "-90.0", "180.0", "90.0"]:
+        ET.SubElement(coords_4326, "double").text = val
+
+    meta = ET.SubElement(root, "metaWidthHeight")
+    ET.SubElement(meta, "int").text = "4"
+    ET.SubElement(meta, "int").text = "4"
+
+    ET.SubElement(root, "expireCache").text = "0"
+    ET.SubElement(root, "expireClients").text = "0"
 
+    param_filters = ET.SubElement(root, "parameterFilters")
+    spf = ET.SubElement(param_filters, "stringParameterFilter")
+    ET.SubElement(spf, "key").text = "STYLES"
+    ET.SubElement(spf, "defaultValue")
+    values = ET.SubElement(spf, "values")
+    ET.SubElement(values, "string") # Empty string
+    # Ensure BOTH styles are available in the GWC filter
+    ET.SubElement(values, "string").text = "__WS__:dwg_generic_style"
+    ET.SubElement(values, "string").text = "__WS__:dwg_raster_style"
 
-def enable_gwc_mvt(layer_name: str) -> tuple[bool, str]:
+    return ET.tostring(root, encoding="unicode")
+
+
+_GWC_LAYER_XML_TMPL = _build_gwc_layer_xml_template()
+_TRUNCATE_TMPL = "<truncateLayer><layerName>__L__</layerName></truncateLayer>"
+
+
+def enable_gwc_mvt(layer_name: str, ws: str | None = None) -> tuple[bool, str]:
     """
     配置 GWC 缓存，启用 application/vnd.mapbox-vector-tile 格式
     """
     try:
-        ws = settings.geoserver_workspace
+        ws = ws or workspace_for(layer_name)
         full_layer_name = f"{ws}:{layer_name}"
         
         # GWC Layer Configuration URL (GeoServer internal GWC)
         # Endpoint: /geoserver/gwc/rest/layers/{layerName}
-        base = settings.geoserver_url.rstrip("/")
-        url = f"{base}/gwc/rest/layers/{full_layer_name}.xml"
+        url = f"gwc/rest/layers/{full_layer_name}.xml"
         
-        # Style name with workspace
-        style_name = "dwg_generic_style"
-        full_style_name = f"{ws}:{style_name}"
+        xml_body = (
+            _GWC_LAYER_XML_TMPL
+            .replace("__LAYER__", escape(full_layer_name))
+            .replace("__WS__", escape(ws))
+            .encode("utf-8")
+        )
 
-        # Build XML using ElementTree for safety
-        root = ET.Element("GeoServerLayer")
-        
-        ET.SubElement(root, "enabled").text = "true"
-        ET.SubElement(root, "inMemoryCached").text = "true"
-        ET.SubElement(root, "name").text = full_layer_name
-        ET.SubElement(root, "gutter").text = "100"
-        
-        mime_formats = ET.SubElement(root, "mimeFormats")
-        for fmt in ["image/png", "image/jpeg", "application/vnd.mapbox-vector-tile"]:
-            ET.SubElement(mime_formats, "string").text = fmt
-            
-        grid_subsets = ET.SubElement(root, "gridSubsets")
-        
-        # EPSG:900913
-        gs_900913 = ET.SubElement(grid_subsets, "gridSubset")
-        ET.SubElement(gs_900913, "gridSetName").text = "EPSG:900913"
-        extent_900913 = ET.SubElement(gs_900913, "extent")
-        coords_900913 = ET.SubElement(extent_900913, "coords")
-        for val in ["-20037508.34", "-20037508.34", "20037508.34", "20037508.34"]:
-            ET.SubElement(coords_900913, "double").text = val
-            
-        # EPSG:4326
-        gs_4326 = ET.SubElement(grid_subsets, "gridSubset")
-        ET.SubElement(gs_4326, "gridSetName").text = "EPSG:4326"
-        extent_4326 = ET.SubElement(gs_4326, "extent")
-        coords_4326 = ET.SubElement(extent_4326, "coords")
-        for val in ["-180.0", "-90.0", "180.0", "90.0"]:
-            ET.SubElement(coords_4326, "double").text = val
-            
-        meta = ET.SubElement(root, "metaWidthHeight")
-        ET.SubElement(meta, "int").text = "4"
-        ET.SubElement(meta, "int").text = "4"
+        client = _get_client()
+        _forget_gwc_config(full_layer_name)
+        # Try to PUT (create/update)
+        r = client.put(
+            url, 
+            headers={"Content-Type": "application/xml"}, 
+            content=xml_body
+        )
         
-        ET.SubElement(root, "expireCache").text = "0"
-        ET.SubElement(root, "expireClients").text = "0"
+        if r.status_code in (200, 201):
+            return True, ""
         
-        param_filters = ET.SubElement(root, "parameterFilters")
-        spf = ET.SubElement(param_filters, "stringParameterFilter")
-        ET.SubElement(spf, "key").text = "STYLES"
-        ET.SubElement(spf, "defaultValue")
-        values = ET.SubElement(spf, "values")
-        ET.SubElement(values, "string") # Empty string
-        # Ensure BOTH styles are available in the GWC filter
-        ET.SubElement(values, "string").text = f"{ws}:dwg_generic_style"
-        ET.SubElement(values, "string").text = f"{ws}:dwg_raster_style"
+        # If 404 on PUT (rare for GWC rest), try POST? 
+        # Usually PUT to /layers/{name} works if it exists or creates it.
+        # But official docs say POST to /layers to create.
         
-        xml_body = ET.tostring(root, encoding="unicode")
-
-        with httpx.Client(timeout=30.0) as client:
-            # Try to PUT (create/update)
-            r = client.put(
-                url, 
-                headers={**_auth_headers(), "Content-Type": "application/xml"}, 
+        if r.status_code == 404:
+            create_url = "gwc/rest/layers"
+            r2 = client.post(
+                create_url,
+                headers={"Content-Type": "application/xml"},
                 content=xml_body
             )
-            
-            if r.status_code in (200, 201):
+            if r2.status_code in (200, 201):
                 return True, ""
+            return False, f"GWC Layer 创建失败: {r2.status_code} {r2.text[:200]}"
             
-            # If 404 on PUT (rare for GWC rest), try POST? 
-            # Usually PUT to /layers/{name} works if it exists or creates it.
-            # But official docs say POST to /layers to create.
-            
-            if r.status_code == 404:
-                create_url = f"{base}/gwc/rest/layers"
-                r2 = client.post(
-                    create_url,
-                    headers={**_auth_headers(), "Content-Type": "application/xml"},
-                    content=xml_body
-                )
-                if r2.status_code in (200, 201):
-                    return True, ""
-                return False, f"GWC Layer 创建失败: {r2.status_code} {r2.text[:200]}"
-                
-            return False, f"GWC Layer 配置失败: {r.status_code} {r.text[:200]}"
+        return False, f"GWC Layer 配置失败: {r.status_code} {r.text[:200]}"
 
     except Exception as e:
         return False, str(e)
@@ -618,269 +851,354 @@ def publish_gpkg(gpkg_path: Path, store_name: str, layer_name: str, native_layer
     """
     将 GeoPackage 文件发布到 GeoServer。
     native_layer_name: GPKG 中的表名（若不提供，默认尝试自动推断或与 layer_name 相同）
+
+    顺序约束：样式/datastore/featureType 预检可并发；featureType 必须在 datastore 之后创建，
+    图层 PUT（默认样式）必须在 featureType 之后；GWC 配置需图层已存在，截断缓存最后执行。
+    所有请求共用 _get_client() 的连接池，max_connections 即为并发发布的背压上限。
     """
     try:
         gpkg_path = Path(gpkg_path).resolve()
         if not gpkg_path.exists():
             return False, "GeoPackage 文件不存在"
         
-        # 0. Ensure style exists
-        ok_style, msg_style = ensure_dwg_style()
+        # 分片以发布时的 layer_name 为准（已有 featureType 的名称可能不同）
+        ws = workspace_for(layer_name)
+        client = _get_client()
+        pool = _get_probe_pool()
+        # 本次发布用到的 URL 前缀只拼一次
+        ws_base = _rest(f"workspaces/{ws}")
+        store_base = f"{ws_base}/datastores/{store_name}"
+        store_url = store_base + ".json"
+        layers_url = store_base + "/featuretypes.json"
+
+        # 0. 相互独立的预检并发执行：样式、datastore 是否存在、已有 featureType 列表
+        f_style = pool.submit(ensure_dwg_style, ws)
+        f_store = pool.submit(client.head, store_url, params=_QUIET_404)
+        f_layers = pool.submit(client.get, layers_url, params=_QUIET_404)
+        ok_style, msg_style = f_style.result()
+        r = f_store.result()
+        r3 = f_layers.result()
         if not ok_style:
             return False, f"Style creation failed: {msg_style}"
 
-        ws = settings.geoserver_workspace
-        base = _rest("").rstrip("/rest")
-
-        with httpx.Client(timeout=30.0) as client:
-            h = _auth_headers()
-            # 1. 创建 datastore (GeoPackage)
-            store_url = _rest(f"workspaces/{ws}/datastores/{store_name}.json")
-            # GeoServer 2.19+ 支持 GeoPackage：使用 file 存储，path 为 file:///path/to/file.gpkg
-            # Connection Parameters (Flat format for recent GeoServer REST API)
-            body = {
-                "dataStore": {
-                    "name": store_name,
-                    "type": "GeoPackage",
-                    "enabled": True,
-                    "connectionParameters": {
-                        "database": f"file://{gpkg_path.as_posix()}",
-                        "dbtype": "geopackage"
-                    },
-                }
+        # 1. 创建 datastore (GeoPackage)
+        # GeoServer 2.19+ 支持 GeoPackage：使用 file 存储，path 为 file:///path/to/file.gpkg
+        # Connection Parameters (Flat format for recent GeoServer REST API)
+        body = {
+            "dataStore": {
+                "name": store_name,
+                "type": "GeoPackage",
+                "enabled": True,
+                "connectionParameters": {
+                    "database": f"file://{gpkg_path.as_posix()}",
+                    "dbtype": "geopackage"
+                },
             }
-            r = client.get(store_url, headers=h)
-            if r.status_code == 404:
-                create_store_url = _rest(f"workspaces/{ws}/datastores.json")
-                r2 = client.post(
-                    create_store_url,
-                    headers={**h, "Content-Type": "application/json"},
-                    json=body,
-                )
-                if r2.status_code not in (200, 201):
-                    return False, f"创建 datastore 失败: {r2.status_code} {r2.text[:300]}"
-            elif r.status_code != 200:
-                return False, f"查询 datastore 失败: {r.status_code}"
-
-            # 2. 发布图层
-            layers_url = _rest(f"workspaces/{ws}/datastores/{store_name}/featuretypes.json")
-            r3 = client.get(layers_url, headers=h)
-            if r3.status_code != 200:
-                return False, f"获取 feature types 失败: {r3.status_code} {r3.text[:200]}"
-            
+        }
+        if r.status_code == 404:
+            create_store_url = ws_base + "/datastores.json"
+            r2 = client.post(create_store_url, content=_json_dumps(body), headers=_JSON_CONTENT_HEADERS)
+            if r2.status_code not in (200, 201):
+                return False, f"创建 datastore 失败: {r2.status_code} {r2.text[:300]}"
+            # 新建的 datastore 不可能已有 featureType，无需重新获取列表
+            existing = []
+        elif r.status_code != 200:
+            return False, f"查询 datastore 失败: {r.status_code}"
+        elif r3.status_code != 200:
+            return False, f"获取 feature types 失败: {r3.status_code} {r3.text[:200]}"
+        else:
             try:
-                data = r3.json()
-                existing = data.get("featureTypes", {}).get("featureType", [])
+                existing = _json(r3).get("featureTypes", {}).get("featureType", [])
                 if isinstance(existing, dict):
                     existing = [existing]
-                ft_name = existing[0]["name"] if existing else layer_name
             except Exception:
-                ft_name = layer_name
-
-            ft_url = _rest(f"workspaces/{ws}/datastores/{store_name}/featuretypes/{ft_name}.json")
-            r4 = client.get(ft_url, headers=h)
-            if r4.status_code == 404:
-                create_ft_url = _rest(f"workspaces/{ws}/datastores/{store_name}/featuretypes.json")
-                
-                ft_body = {
-                    "featureType": {
-                        "name": layer_name,
-                        "title": layer_name
-                    }
+                existing = []
+
+        # 2. 发布图层
+        if existing:
+            # 列表中已有即说明存在，无需再 HEAD
+            ft_name = existing[0]["name"]
+        else:
+            # 乐观创建：新图层是常见情况，省去存在性探测；已存在时改为 PUT 更新
+            ft_name = layer_name
+
+            ft_body = {
+                "featureType": {
+                    "name": layer_name,
+                    "title": layer_name
                 }
-                if native_layer_name:
-                    ft_body["featureType"]["nativeName"] = native_layer_name
-                elif ft_name != layer_name:
-                     # If we found an existing name, use it? No, we are creating.
-                     pass
-                
-                r_create = client.post(
-                    create_ft_url,
-                    headers={**h, "Content-Type": "application/json"},
-                    json=ft_body,
-                )
-                if r_create.status_code not in (200, 201):
-                    return False, f"创建 featureType 失败: {r_create.status_code} {r_create.text[:200]}"
-                
-                # Update ft_name to the one we just created
-                ft_name = layer_name
-
-            # 2.5 Update layer styles
-            # Do NOT set defaultStyle to dwg_generic_style as it breaks MVT filtering (MVT needs raw data).
-            # Instead, add it to "styles" (Available Styles) so we can request it via STYLES param in raster mode.
-            layer_url = _rest(f"workspaces/{ws}/layers/{ft_name}.json")
-            layer_body = {
-                "layer": {
-                    # We do NOT touch defaultStyle, letting GeoServer pick a safe default (e.g. generic/point/line)
-                    "styles": {
-                        "style": [
-                            { "name": "dwg_generic_style", "workspace": ws }
-                        ]
-                    }
+            }
+            if native_layer_name:
+                ft_body["featureType"]["nativeName"] = native_layer_name
+            ft_payload = _json_dumps(ft_body)
+
+            r_create = client.post(layers_url, content=ft_payload, headers=_JSON_CONTENT_HEADERS)
+            if r_create.status_code == 409 or (
+                r_create.status_code == 500 and "already exists" in r_create.text
+            ):
+                ft_url = f"{store_base}/featuretypes/{ft_name}.json"
+                r_create = client.put(ft_url, content=ft_payload, headers=_JSON_CONTENT_HEADERS)
+            if r_create.status_code not in (200, 201):
+                return False, f"创建 featureType 失败: {r_create.status_code} {r_create.text[:200]}"
+
+        # 2.5 Update layer styles
+        # Do NOT set defaultStyle to dwg_generic_style as it breaks MVT filtering (MVT needs raw data).
+        # Instead, add it to "styles" (Available Styles) so we can request it via STYLES param in raster mode.
+        layer_url = f"{ws_base}/layers/{ft_name}.json"
+        layer_body = {
+            "layer": {
+                # We do NOT touch defaultStyle, letting GeoServer pick a safe default (e.g. generic/point/line)
+                "styles": {
+                    "style": [
+                        { "name": "dwg_generic_style", "workspace": ws }
+                    ]
                 }
             }
-            client.put(layer_url, headers={**h, "Content-Type": "application/json"}, json=layer_body)
+        }
+        # 样式变更会触发 GWC 的 catalog 监听器重写切片图层，必须先于下面的 GWC 配置完成
+        r_layer = client.put(layer_url, content=_json_dumps(layer_body), headers=_JSON_CONTENT_HEADERS)
+        if r_layer.status_code != 200:
+            return False, f"更新图层样式失败: {r_layer.status_code} {r_layer.text[:200]}"
 
         # 3. 启用 GWC MVT 缓存
-        ok_gwc, msg_gwc = enable_gwc_mvt(ft_name)
+        ok_gwc, msg_gwc = enable_gwc_mvt(ft_name, ws)
         if not ok_gwc:
             return False, f"GWC 切片配置失败: {msg_gwc}"
-        
+
         # 4. 清理旧缓存 (解决更新后显示旧数据问题)
-        truncate_gwc_layer(ft_name)
+        truncate_gwc_layer(ft_name, ws)
             
         return True, ""
     except Exception as e:
         return False, str(e)
 
 
+# 切片 URL 的固定部分在导入时拼好，getter 只需填入图层名
+_PUBLIC_BASE = (settings.geoserver_public_url or settings.geoserver_url).rstrip("/")
+_WMTS_PREFIX = f"{_PUBLIC_BASE}/gwc/service/wmts?layer="
+_WMTS_TAIL = (
+    "&tilematrixset=EPSG:900913"
+    "&Service=WMTS&Request=GetTile&Version=1.0.0"
+    "&Format={fmt}"
+    "{style}"
+    "&TileMatrix=EPSG:900913:{{z}}&TileRow={{y}}&TileCol={{x}}"
+)
+_WMTS_TAIL_MVT = _WMTS_TAIL.format(fmt="application/vnd.mapbox-vector-tile", style="")
+
+
+@lru_cache(maxsize=64)
+def _wmts_tail_png(ws: str, style_name: str) -> str:
+    return _WMTS_TAIL.format(fmt="image/png", style="&style=" + quote(f"{ws}:{style_name}"))
+
+_WMTS_CAPABILITIES_URL = f"{_PUBLIC_BASE}/gwc/service/wmts?request=GetCapabilities"
+
+
+@lru_cache(maxsize=4096)
 def get_mvt_url(layer_name: str) -> str:
     """返回该图层的 MVT 矢量切片 URL 模板（OpenLayers 等可用）"""
     # GeoServer GWC WMTS 矢量切片示例:
     # {base}/gwc/service/wmts?layer=workspace:layer&tilematrixset=EPSG:900913&...
-    base = (settings.geoserver_public_url or settings.geoserver_url).rstrip("/")
-    ws = settings.geoserver_workspace
-    try:
-        from urllib.parse import quote
-        layer_param = quote(f"{ws}:{layer_name}")
-    except Exception:
-        layer_param = f"{ws}:{layer_name}"
-    return (
-        f"{base}/gwc/service/wmts?"
-        f"layer={layer_param}"
-        "&tilematrixset=EPSG:900913"
-        "&Service=WMTS&Request=GetTile&Version=1.0.0"
-        "&Format=application/vnd.mapbox-vector-tile"
-        "&TileMatrix=EPSG:900913:{z}&TileRow={y}&TileCol={x}"
-    )
-
+    return f"{_WMTS_PREFIX}{quote(f'{workspace_for(layer_name)}:{layer_name}')}{_WMTS_TAIL_MVT}"
 
+@lru_cache(maxsize=4096)
 def get_raster_url(layer_name: str) -> str:
     """返回该图层的 XYZ 栅格切片 URL 模板"""
-    base = (settings.geoserver_public_url or settings.geoserver_url).rstrip("/")
-    ws = settings.geoserver_workspace
-    
-    style_name = "dwg_generic_style"
-    full_style_name = f"{ws}:{style_name}"
-    
-    try:
-        from urllib.parse import quote
-        layer_param = quote(f"{ws}:{layer_name}")
-        style_param = quote(full_style_name)
-    except Exception:
-        layer_param = f"{ws}:{layer_name}"
-        style_param = full_style_name
-        
-    return (
-        f"{base}/gwc/service/wmts?"
-        f"layer={layer_param}"
-        "&tilematrixset=EPSG:900913"
-        "&Service=WMTS&Request=GetTile&Version=1.0.0"
-        "&Format=image/png"
-        f"&style={style_param}"
-        "&TileMatrix=EPSG:900913:{z}&TileRow={y}&TileCol={x}"
-    )
-
+    ws = workspace_for(layer_name)
+    return f"{_WMTS_PREFIX}{quote(f'{ws}:{layer_name}')}{_wmts_tail_png(ws, 'dwg_generic_style')}"
 
 def get_wmts_capabilities_url() -> str:
     """WMTS 能力文档 URL"""
-    base = (settings.geoserver_public_url or settings.geoserver_url).rstrip("/")
-    return f"{base}/gwc/service/wmts?request=GetCapabilities"
+    return _WMTS_CAPABILITIES_URL
 
-def ensure_dwg_raster_style() -> tuple[bool, str]:
+def ensure_dwg_raster_style(ws: str | None = None) -> tuple[bool, str]:
     """Ensure dwg_raster_style exists (for raster tiles with better text/color)"""
+    ws = ws or settings.geoserver_workspace
+    return _ensure_cached(_style_ready, (ws, "dwg_raster_style"), partial(_ensure_dwg_raster_style, ws))
+
+
+def _ensure_dwg_raster_style(ws: str) -> tuple[bool, str]:
     try:
         style_name = "dwg_raster_style"
-        ws = settings.geoserver_workspace
-        base = settings.geoserver_url.rstrip("/")
-        # Check if style exists in workspace
-        url = f"{base}/rest/workspaces/{ws}/styles/{style_name}.json"
+        # Check if style exists in workspace, fetching the stored SLD itself
+        url = _rest(f"workspaces/{ws}/styles/{style_name}.sld")
         
-        with httpx.Client(timeout=30.0) as client:
-            h_sld = {**_auth_headers(), "Content-Type": "application/vnd.ogc.sld+xml"}
-            
-            r = client.get(url, headers=_auth_headers())
-            if r.status_code == 200:
-                # Update it to ensure latest SLD
-                client.put(
-                    f"{base}/rest/workspaces/{ws}/styles/{style_name}",
-                    headers=h_sld,
-                    content=DWG_RASTER_SLD
-                )
+        client = _get_client()
+        r = client.get(url, params=_QUIET_404, headers=_SLD_ACCEPT_HEADERS)
+        if r.status_code == 200:
+            if _sld_digest(r.content) == _RASTER_SLD_HASH:
                 return True, ""
-                
-            # Create style
-            create_url = f"{base}/rest/workspaces/{ws}/styles"
-            r2 = client.post(
-                create_url, 
-                params={"name": style_name},
-                headers=h_sld,
-                content=DWG_RASTER_SLD
+            # Update it to ensure latest SLD
+            client.put(
+                _rest(f"workspaces/{ws}/styles/{style_name}"),
+                params={"raw": "true"},
+                headers=_SLD_CONTENT_HEADERS,
+                content=DWG_RASTER_SLD_BYTES
             )
+            return True, ""
             
-            if r2.status_code in (200, 201):
-                return True, ""
-            return False, f"Create raster style failed: {r2.status_code} {r2.text[:200]}"
+        # Create style
+        create_url = _rest(f"workspaces/{ws}/styles")
+        r2 = client.post(
+            create_url, 
+            params={"name": style_name},
+            headers=_SLD_CONTENT_HEADERS,
+            content=DWG_RASTER_SLD_BYTES
+        )
+        
+        if r2.status_code in (200, 201):
+            return True, ""
+        return False, f"Create raster style failed: {r2.status_code} {r2.text[:200]}"
             
     except Exception as e:
         return False, str(e)
 
 
+_XML_FEED_CHUNK = 64 * 1024
+
+# GWC 图层配置缓存：full_layer_name -> (ETag, XML)，配合 If-None-Match 省去未变化时的正文传输
+_GWC_ETAG_CACHE_MAX = 256
+_gwc_etag_cache: dict[str, tuple[str, str]] = {}
+_gwc_etag_lock = threading.Lock()
+
+
+def _forget_gwc_config(full_layer_name: str) -> None:
+    with _gwc_etag_lock:
+        _gwc_etag_cache.pop(full_layer_name, None)
+
+
+def _get_gwc_layer_config(client: httpx.Client, url: str, full_layer_name: str) -> tuple[int, str]:
+    """GET the GWC layer XML, revalidating a cached copy with If-None-Match"""
+    h = {"Accept": "text/xml"}
+    with _gwc_etag_lock:
+        cached = _gwc_etag_cache.get(full_layer_name)
+    if cached:
+        h["If-None-Match"] = cached[0]
+    r = client.get(url, headers=h)
+    if r.status_code == 304 and cached:
+        return 200, cached[1]
+    if r.status_code == 200:
+        etag = r.headers.get("ETag")
+        with _gwc_etag_lock:
+            if etag:
+                if len(_gwc_etag_cache) >= _GWC_ETAG_CACHE_MAX:
+                    _gwc_etag_cache.pop(next(iter(_gwc_etag_cache)))
+                _gwc_etag_cache[full_layer_name] = (etag, r.text)
+            else:
+                _gwc_etag_cache.pop(full_layer_name, None)
+    return r.status_code, r.text
+
+
+def _patch_gwc_layer_xml(xml_content: str, full_layer_name: str, full_style_name: str) -> tuple[ET.Element, bool]:
+    """流式解析 GWC 图层配置：校正 <name>，并把样式加入 STYLES 参数过滤器。返回 (root, 是否修改)"""
+    parser = ET.XMLPullParser(("start", "end"))
+    root = None
+    depth = 0
+    updated = False
+    for i in range(0, len(xml_content), _XML_FEED_CHUNK):
+        parser.feed(xml_content[i:i + _XML_FEED_CHUNK])
+        for event, elem in parser.read_events():
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = elem
+                continue
+            depth -= 1
+            # FIX: Ensure name is correct (fix encoding issues) —— 仅根节点下的 <name>
+            if depth == 1 and elem.tag == "name" and elem.text != full_layer_name:
+                log.info("Fixing GWC layer name from '%s' to '%s'", elem.text, full_layer_name)
+                elem.text = full_layer_name
+                updated = True
+            # parameterFilters -> stringParameterFilter[key=STYLES] -> values
+            elif depth == 2 and elem.tag == "stringParameterFilter":
+                key = elem.find("key")
+                values = elem.find("values")
+                if key is None or key.text != "STYLES" or values is None:
+                    continue
+                if not any(v.text == full_style_name for v in values.iterfind("string")):
+                    new_val = ET.SubElement(values, "string")
+                    new_val.text = full_style_name
+                    updated = True
+    parser.close()
+    return root, updated
+
+
+_GWC_NAME_RE = re.compile(r"<name>(.*?)</name>", re.DOTALL)
+_GWC_EMPTY_VALUES_RE = re.compile(r"<values\s*/>")
+_GWC_STYLES_FILTER_RE = re.compile(
+    r"<stringParameterFilter>\s*<key>STYLES</key>.*?</stringParameterFilter>", re.DOTALL
+)
+
+
+def _splice_gwc_layer_xml(xml_content: str, full_layer_name: str, full_style_name: str) -> tuple[str, bool] | None:
+    """在原文上直接改写 <name> 与 STYLES 取值，不构建 DOM。结构不符合预期时返回 None（由调用方走解析路径）"""
+    name_m = _GWC_NAME_RE.search(xml_content)
+    spf_m = _GWC_STYLES_FILTER_RE.search(xml_content)
+    if name_m is None or spf_m is None:
+        return None
+    block = spf_m.group(0)
+    values_end = block.rfind("</values>")
+    empty_m = _GWC_EMPTY_VALUES_RE.search(block) if values_end < 0 else None
+    if values_end < 0 and empty_m is None:
+        return None
+
+    edits = []  # (start, end, replacement)，按位置升序
+    if unescape(name_m.group(1)) != full_layer_name:
+        log.info("Fixing GWC layer name from '%s' to '%s'", name_m.group(1), full_layer_name)
+        edits.append((name_m.start(1), name_m.end(1), escape(full_layer_name)))
+    style_elem = f"<string>{escape(full_style_name)}</string>"
+    if empty_m is not None:
+        # <values/>：整体替换为带一个取值的元素
+        edits.append((spf_m.start() + empty_m.start(), spf_m.start() + empty_m.end(), f"<values>{style_elem}</values>"))
+    elif style_elem not in block:
+        pos = spf_m.start() + values_end
+        edits.append((pos, pos, style_elem))
+    if not edits:
+        return xml_content, False
+
+    edits.sort()
+    parts = []
+    last = 0
+    for start, end, text in edits:
+        parts.append(xml_content[last:start])
+        parts.append(text)
+        last = end
+    parts.append(xml_content[last:])
+    return "".join(parts), True
+
+
 def _update_gwc_layer_styles(layer_name: str, style_name: str) -> None:
     """Helper to update GWC layer configuration to allow a style"""
     try:
-        ws = settings.geoserver_workspace
-        base = settings.geoserver_url.rstrip("/")
+        ws = workspace_for(layer_name)
         full_layer_name = f"{ws}:{layer_name}"
         full_style_name = f"{ws}:{style_name}"
         
-        url = f"{base}/gwc/rest/layers/{full_layer_name}.xml"
+        url = f"gwc/rest/layers/{full_layer_name}.xml"
         
-        with httpx.Client(timeout=10.0) as client:
-            h = {**_auth_headers(), "Accept": "text/xml"}
-            r = client.get(url, headers=h)
-            if r.status_code != 200:
-                print(f"Failed to get GWC layer config: {r.status_code}")
-                return
-                
-            xml_content = r.text
-            root = ET.fromstring(xml_content)
-            updated = False
+        client = _get_client()
+        status, xml_content = _get_gwc_layer_config(client, url, full_layer_name)
+        if status != 200:
+            log.warning("Failed to get GWC layer config for %s: %s", full_layer_name, status)
+            return
             
-            # FIX: Ensure name is correct (fix encoding issues)
-            name_elem = root.find("name")
-            if name_elem is not None and name_elem.text != full_layer_name:
-                print(f"Fixing GWC layer name from '{name_elem.text}' to '{full_layer_name}'")
-                name_elem.text = full_layer_name
-                updated = True
-
-            # Find parameterFilters -> stringParameterFilter[key=STYLES] -> values
-            param_filters = root.find("parameterFilters")
-            if param_filters:
-                for spf in param_filters.findall("stringParameterFilter"):
-                    key = spf.find("key")
-                    if key is not None and key.text == "STYLES":
-                        values = spf.find("values")
-                        if values is not None:
-                            # Check if style already exists in values
-                            existing_values = [v.text for v in values.findall("string")]
-                            if full_style_name not in existing_values:
-                                # Add new string value
-                                new_val = ET.Element("string")
-                                new_val.text = full_style_name
-                                values.append(new_val)
-                                updated = True
+        # 常见情况直接在原文上拼接，不分配任何树节点；结构意外时才退回流式解析 + 重新序列化
+        spliced = _splice_gwc_layer_xml(xml_content, full_layer_name, full_style_name)
+        if spliced is not None:
+            new_xml, updated = spliced
+        else:
+            root, updated = _patch_gwc_layer_xml(xml_content, full_layer_name, full_style_name)
+            new_xml = ET.tostring(root, encoding="unicode") if updated else xml_content
+        
+        if updated:
+            # PUT back
+            h_put = {"Content-Type": "text/xml"}
+            r_put = client.put(url, headers=h_put, content=new_xml)
+            _forget_gwc_config(full_layer_name)
+            if r_put.status_code != 200:
+                log.warning("Failed to update GWC layer %s: %s %s", full_layer_name, r_put.status_code, r_put.text[:200])
             
-            if updated:
-                # PUT back
-                h_put = {**_auth_headers(), "Content-Type": "text/xml"}
-                new_xml = ET.tostring(root, encoding="unicode")
-                r_put = client.put(url, headers=h_put, content=new_xml)
-                if r_put.status_code != 200:
-                    print(f"Failed to update GWC layer: {r_put.status_code} {r_put.text}")
-                
     except Exception as e:
-        print(f"Error updating GWC layer styles: {e}")
+        log.exception("Error updating GWC layer styles for %s", layer_name)
 
 
 def add_raster_style_to_layer(layer_name: str) -> tuple[bool, str]:
@@ -889,65 +1207,43 @@ def add_raster_style_to_layer(layer_name: str) -> tuple[bool, str]:
     This does NOT change the default style (preserving MVT behavior).
     """
     try:
-        ws = settings.geoserver_workspace
-        base = settings.geoserver_url.rstrip("/")
+        ws = workspace_for(layer_name)
         
         # 1. Ensure style exists
-        ok, msg = ensure_dwg_raster_style()
+        ok, msg = ensure_dwg_raster_style(ws)
         if not ok:
             return False, msg
             
-        # 2. Add to layer
-        layer_url = f"{base}/rest/workspaces/{ws}/layers/{layer_name}.json"
-        with httpx.Client(timeout=30.0) as client:
-            h = {**_auth_headers(), "Content-Type": "application/json"}
-            
-            # We must be careful not to overwrite existing styles, but here we know the structure.
-            # We want "dwg_generic_style" AND "dwg_raster_style" available.
-            
-            layer_body = {
-                "layer": {
-                    "styles": {
-                        "style": [
-                            { "name": "dwg_generic_style", "workspace": ws },
-                            { "name": "dwg_raster_style", "workspace": ws }
-                        ]
-                    }
+        # 2. Add to layer（必须在样式创建之后）
+        layer_url = _rest(f"workspaces/{ws}/layers/{layer_name}.json")
+        client = _get_client()
+        
+        # We must be careful not to overwrite existing styles, but here we know the structure.
+        # We want "dwg_generic_style" AND "dwg_raster_style" available.
+        
+        layer_body = {
+            "layer": {
+                "styles": {
+                    "style": [
+                        { "name": "dwg_generic_style", "workspace": ws },
+                        { "name": "dwg_raster_style", "workspace": ws }
+                    ]
                 }
             }
-            r = client.put(layer_url, headers=h, json=layer_body)
-            if r.status_code == 200:
-                # Ensure GWC also knows about this style
-                _update_gwc_layer_styles(layer_name, "dwg_raster_style")
-                return True, ""
-            return False, f"Update layer styles failed: {r.status_code} {r.text[:200]}"
-            
+        }
+        r = client.put(layer_url, json=layer_body)
+        if r.status_code == 200:
+            # Ensure GWC also knows about this style（只在图层确实带上该样式后更新，GWC 不会宣告图层没有的样式）
+            _update_gwc_layer_styles(layer_name, "dwg_raster_style")
+            return True, ""
+        return False, f"Update layer styles failed: {r.status_code} {r.text[:200]}"
+        
     except Exception as e:
         return False, str(e)
 
 
+@lru_cache(maxsize=4096)
 def get_raster_url_v2(layer_name: str) -> str:
     """Return XYZ raster tile URL using the new dwg_raster_style"""
-    base = (settings.geoserver_public_url or settings.geoserver_url).rstrip("/")
-    ws = settings.geoserver_workspace
-    
-    style_name = "dwg_raster_style"
-    full_style_name = f"{ws}:{style_name}"
-    
-    try:
-        from urllib.parse import quote
-        layer_param = quote(f"{ws}:{layer_name}")
-        style_param = quote(full_style_name)
-    except Exception:
-        layer_param = f"{ws}:{layer_name}"
-        style_param = full_style_name
-        
-    return (
-        f"{base}/gwc/service/wmts?"
-        f"layer={layer_param}"
-        "&tilematrixset=EPSG:900913"
-        "&Service=WMTS&Request=GetTile&Version=1.0.0"
-        "&Format=image/png"
-        f"&style={style_param}"
-        "&TileMatrix=EPSG:900913:{z}&TileRow={y}&TileCol={x}"
-    )
+    ws = workspace_for(layer_name)
+    return f"{_WMTS_PREFIX}{quote(f'{ws}:{layer_name}')}{_wmts_tail_png(ws, 'dwg_raster_style')}"
@@ -11,7 +11,12 @@ def check_extent():
         return
 
     print(f"Checking extent for {gpkg_path}...")
-    conn = sqlite3.connect(gpkg_path)
+    # Read-only open + mmap: rtree leaf pages come straight from the OS page cache, no read() copies
+    conn = sqlite3.connect(f"{gpkg_path.resolve().as_uri()}?mode=ro", uri=True)
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
     c = conn.cursor()
     try:
         # Check if gpkg_contents exists
@@ -25,8 +30,12 @@ def check_extent():
         # No, that's too hard.
         # But wait, we previously saw rtree triggers.
         # We can query the rtree table!
-        c.execute("SELECT min(minx), min(miny), max(maxx), max(maxy) FROM rtree_entities__ogr_geometry_")
-        row = c.fetchone()
+        try:
+            c.execute("SELECT min(minx), min(miny), max(maxx), max(maxy) FROM rtree_entities__ogr_geometry_")
+            row = c.fetchone()
+        except sqlite3.OperationalError:
+            # No spatial index: the declared extent from gpkg_contents was already printed above
+            row = None
         if row:
              print(f"Actual Data Extent (from RTree): MinX={row[0]}, MinY={row[1]}, MaxX={row[2]}, MaxY={row[3]}")
              
@@ -1,41 +1,73 @@
+import functools
 import httpx
 from app.config import settings
 import sys
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+# Single client: check_raster and inspect_gwc reuse the same keep-alive connection
+_client = httpx.Client(
+    auth=(settings.geoserver_user, settings.geoserver_password),
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60.0),
+)
+
+JOB_PREFIX = "d8ad19e8"
+
+# The layer list is requested once and shared by check_raster and inspect_gwc
+def _workspaces() -> list[str]:
+    """All workspaces layers can be published to (one per shard when geoserver_workspace_shards > 1)"""
+    shards = settings.geoserver_workspace_shards
+    if shards <= 1:
+        return [settings.geoserver_workspace]
+    return [f"{settings.geoserver_workspace}_{n}" for n in range(shards)]
+
+
+@functools.lru_cache(maxsize=1)
+def _find_layer(job_prefix: str) -> tuple[str | None, str, tuple[str, ...]]:
+    """Return (matching layer name, its workspace, all layer names across workspaces) for a job id prefix"""
+    base_url = settings.geoserver_url.rstrip("/")
+    found = []  # (layer name, workspace)
+    for ws in _workspaces():
+        r = _client.get(f"{base_url}/rest/workspaces/{ws}/layers.json")
+        if r.status_code == 404:
+            # Shard workspaces are created lazily on first publish
+            continue
+        if r.status_code != 200:
+            raise RuntimeError(f"Failed to list layers in {ws}: {r.status_code}")
+        layers = _loads(r.content).get("layers", {}) or {}
+        found.extend((l["name"], ws) for l in layers.get("layer", []))
+    # Layer names look like layer_{job_id}; the job id is not at the start, so keep substring matching rather than startswith
+    # The workspace is the one the layer was actually listed in (workspace_for(name) for sharded publishes)
+    target, ws = next(((n, w) for n, w in found if job_prefix in n), (None, settings.geoserver_workspace))
+    return target, ws, tuple(n for n, _ in found)
+
+
 def check_raster():
     base_url = settings.geoserver_url.rstrip("/")
-    ws = settings.geoserver_workspace
-    auth = (settings.geoserver_user, settings.geoserver_password)
     
-    print(f"GeoServer: {base_url}, Workspace: {ws}")
+    print(f"GeoServer: {base_url}, Workspaces: {_workspaces()}")
     
     # 1. List layers to find one matching the job
     # The log showed layer name containing 'd8ad19e8'
     try:
-        r = httpx.get(f"{base_url}/rest/workspaces/{ws}/layers.json", auth=auth)
-        if r.status_code != 200:
-            print(f"Failed to list layers: {r.status_code}")
-            return
-            
-        layers = r.json().get("layers", {}).get("layer", [])
-        target_layer = None
-        for l in layers:
-            if "d8ad19e8" in l["name"]:
-                target_layer = l["name"]
-                break
+        target_layer, ws, names = _find_layer(JOB_PREFIX)
         
         if not target_layer:
-            print("Target layer for job d8ad19e8 not found.")
+            print(f"Target layer for job {JOB_PREFIX} not found.")
             # Print first 5 layers just in case
-            print("Available layers:", [l["name"] for l in layers[:5]])
+            print("Available layers:", list(names[:5]))
             return
             
-        print(f"Found layer: {target_layer}")
+        print(f"Found layer: {target_layer} (workspace {ws})")
         
         # 2. Check layer styles
-        r_layer = httpx.get(f"{base_url}/rest/workspaces/{ws}/layers/{target_layer}.json", auth=auth)
+        r_layer = _client.get(f"{base_url}/rest/workspaces/{ws}/layers/{target_layer}.json")
         if r_layer.status_code == 200:
-            styles = r_layer.json().get("layer", {}).get("styles", {})
+            styles = _loads(r_layer.content).get("layer", {}).get("styles", {})
             print(f"Layer styles: {styles}")
         
         # 3. Try WMS GetMap (Raster)
@@ -61,7 +93,7 @@ def check_raster():
         }
         
         print(f"Requesting WMTS: {wmts_url} with params {params_wmts}")
-        r_wmts = httpx.get(wmts_url, params=params_wmts, auth=auth, timeout=30.0)
+        r_wmts = _client.get(wmts_url, params=params_wmts)
         
         print(f"WMTS Status: {r_wmts.status_code}")
         if r_wmts.status_code != 200:
@@ -75,19 +107,13 @@ def check_raster():
 
 def inspect_gwc():
     base_url = settings.geoserver_url.rstrip("/")
-    ws = settings.geoserver_workspace
-    auth = (settings.geoserver_user, settings.geoserver_password)
     
-    # Need layer name again
-    # Quick hack: duplicate logic or just hardcode if we found it
-    # Let's search again briefly
-    r = httpx.get(f"{base_url}/rest/workspaces/{ws}/layers.json", auth=auth)
-    layers = r.json().get("layers", {}).get("layer", [])
-    target_layer = None
-    for l in layers:
-        if "d8ad19e8" in l["name"]:
-            target_layer = l["name"]
-            break
+    # Reuses the layer list fetched by check_raster
+    try:
+        target_layer, ws, _ = _find_layer(JOB_PREFIX)
+    except RuntimeError as e:
+        print(e)
+        return
             
     if not target_layer:
         print("Layer not found for inspection")
@@ -97,7 +123,7 @@ def inspect_gwc():
     url = f"{base_url}/gwc/rest/layers/{full_layer}.xml"
     print(f"\nFetching GWC Config for: {url}")
     
-    r = httpx.get(url, auth=auth)
+    r = _client.get(url)
     print(f"Status: {r.status_code}")
     if r.status_code == 200:
         print("XML Content:")
@@ -106,5 +132,8 @@ def inspect_gwc():
         print(f"Error: {r.text}")
 
 if __name__ == "__main__":
-    check_raster()
-    inspect_gwc()
+    try:
+        check_raster()
+        inspect_gwc()
+    finally:
+        _client.close()
@@ -4,9 +4,12 @@ from pathlib import Path
 import sqlite3
 
 # Setup Environment for GDAL and LibreDWG
-tools_dir = r"D:\project\LibreDWG\backend\tools"
-# Add tools_dir for dwg2dxf.exe
-os.environ["PATH"] = f"{tools_dir};{tools_dir}\\gdal\\bin\\gdal\\apps;{tools_dir}\\gdal\\bin;{os.environ['PATH']}"
+tools_dir = Path(r"D:\project\LibreDWG\backend\tools")
+# Register DLL search dirs directly (Windows, Python 3.8+) instead of prepending to PATH
+if hasattr(os, "add_dll_directory"):
+    for d in (tools_dir, tools_dir / "gdal" / "bin", tools_dir / "gdal" / "bin" / "gdal" / "apps"):
+        if d.is_dir():
+            os.add_dll_directory(str(d))
 os.environ["GDAL_DATA"] = f"{tools_dir}\\gdal\\bin\\gdal-data"
 os.environ["PROJ_LIB"] = f"{tools_dir}\\gdal\\bin\\proj9\\share"
 
@@ -15,13 +18,13 @@ gpkg_path = Path(r"D:\project\LibreDWG\backend\data\jobs\eb9baa721885d3f0fe07dbc
 if gpkg_path.exists():
     print(f"Inspecting {gpkg_path}...")
     conn = sqlite3.connect(gpkg_path)
-    conn.text_factory = lambda b: b.decode(errors="ignore")
     c = conn.cursor()
     
-    c.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'entities'")
+    # Fetch as BLOB and decode once, instead of text_factory calling back into Python for every TEXT value
+    c.execute("SELECT CAST(name AS BLOB), CAST(sql AS BLOB) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'entities'")
     triggers = c.fetchall()
     for name, sql in triggers:
-        print(f"Trigger {name}: {sql}")
+        print(f"Trigger {name.decode(errors='ignore')}: {(sql or b'').decode(errors='ignore')}")
         
     conn.close()
 else:
@@ -8,9 +8,11 @@ print(f"GDAL_BIN_DIR: {GDAL_BIN_DIR}")
 print(f"Exists: {GDAL_BIN_DIR.exists()}")
 
 proj_lib = GDAL_BIN_DIR / "proj9" / "share"
-print(f"Checking {proj_lib}: {proj_lib.exists()}")
+# Probe each candidate once and reuse the result
+proj_found = proj_lib.exists()
+print(f"Checking {proj_lib}: {proj_found}")
 
-if not proj_lib.exists():
+if not proj_found:
     proj_lib = GDAL_BIN_DIR / "proj" / "share"
     print(f"Checking {proj_lib}: {proj_lib.exists()}")
 
@@ -5,7 +5,7 @@ from app.services.conversion import _run, settings
 
 def test_shift():
     src = Path("test_src.gpkg")
-    if src.exists(): src.unlink()
+    src.unlink(missing_ok=True)
     
     with open("test.csv", "w") as f:
         f.write("id,name,wkt\n1,test,POINT(100 100)")
@@ -16,7 +16,7 @@ def test_shift():
     os.remove("test.csv")
     
     dst = Path("test_dst.gpkg")
-    if dst.exists(): dst.unlink()
+    dst.unlink(missing_ok=True)
     
     # Try float args
     sql = "SELECT ST_Translate(geom, -10.0, -10.0) as geom, * FROM test"
@@ -32,7 +32,7 @@ def test_shift():
         print(f"Failed: {out}")
         
         # Try 3 args (z)
-        if dst.exists(): dst.unlink()
+        dst.unlink(missing_ok=True)
         sql = "SELECT ST_Translate(geom, -10.0, -10.0, 0.0) as geom, * FROM test"
         print(f"Trying: {sql}")
         cmd = [ogr2ogr, "-f", "GPKG", str(dst), str(src), "-dialect", "SQLite", "-sql", sql, "-nln", "test_layer"]
@@ -43,8 +43,8 @@ def test_shift():
              print(f"Failed: {out}")
 
     # Clean up
-    if src.exists(): src.unlink()
-    if dst.exists(): dst.unlink()
+    src.unlink(missing_ok=True)
+    dst.unlink(missing_ok=True)
 
 if __name__ == "__main__":
     test_shift()
@@ -1,24 +1,25 @@
+import os
 import sqlite3
 import sys
 from pathlib import Path
 
 # Correct path found previously
 jobs_dir = Path(r"d:\project\LibreDWG\backend\data\jobs")
-target_job = None
-for job_dir in jobs_dir.iterdir():
-    if job_dir.name.startswith("bf0ce2e3"):
-        target_job = job_dir
-        break
+# scandir's DirEntry carries the file type, avoiding a stat per entry from iterdir + glob
+with os.scandir(jobs_dir) as it:
+    target_job = next((e.path for e in it if e.name.startswith("bf0ce2e3") and e.is_dir()), None)
 
 if not target_job:
     sys.exit(1)
 
-gpkg_files = list(target_job.glob("*.gpkg"))
-gpkg_path = gpkg_files[0]
+with os.scandir(target_job) as it:
+    gpkg_path = next((Path(e.path) for e in it if e.name.endswith(".gpkg") and e.is_file()), None)
+if gpkg_path is None:
+    sys.exit(1)
 
-conn = sqlite3.connect(gpkg_path)
-c = conn.cursor()
-c.execute("PRAGMA table_info(entities)")
-cols = [r[1] for r in c.fetchall()]
+conn = sqlite3.connect(f"{gpkg_path.resolve().as_uri()}?mode=ro", uri=True)
+conn.execute("PRAGMA mmap_size=67108864")
+# The table-valued function projects just the name column instead of building the full 6-tuple per column
+cols = [r[0] for r in conn.execute("SELECT name FROM pragma_table_info('entities')")]
 print("Columns:", cols)
 conn.close()
@@ -4,114 +4,150 @@ import math
 import struct
 from pathlib import Path
 
+import numpy as np
+
+from gpkg_indexes import ensure_indexes
+
+# Web Mercator scale factors: degrees -> metres for X, asinh(tan(lat)) -> metres for Y
+_DEG2MERC = 20037508.34 / 180.0
+_MERC_Y = 20037508.34 / math.pi
+_RAD = math.pi / 180.0
+
 def wgs84_to_webmercator(lon, lat):
     """Convert WGS84 lon/lat to Web Mercator X/Y"""
     if abs(lon) > 180 or abs(lat) > 90:
         return 0.0, 0.0
-    x = lon * 20037508.34 / 180.0
-    try:
-        y = math.log(math.tan((90 + lat) * math.pi / 360.0)) / (math.pi / 180.0)
-    except:
-        y = 0.0
-    y = y * 20037508.34 / 180.0
+    x = lon * _DEG2MERC
+    # ln(tan(pi/4 + lat/2)) == asinh(tan(lat))
+    y = math.asinh(math.tan(lat * _RAD)) * _MERC_Y
     return x, y
 
+def wgs84_to_webmercator_arrays(lon, lat):
+    """Vectorized wgs84_to_webmercator; out-of-range points map to (0, 0) as in the scalar version"""
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    ok = (np.abs(lon) <= 180) & (np.abs(lat) <= 90)
+    x = np.where(ok, lon * _DEG2MERC, 0.0)
+    with np.errstate(invalid='ignore'):
+        y = np.where(ok, np.arcsinh(np.tan(lat * _RAD)) * _MERC_Y, 0.0)
+    return x, y
+
+# Precompiled WKB codecs keyed by endian prefix ('<' little, '>' big)
+_XY = {"<": struct.Struct("<2d"), ">": struct.Struct(">2d")}
+_U32 = {"<": struct.Struct("<I"), ">": struct.Struct(">I")}
+# GPKG header length by envelope indicator (flags bits 1-3): 8-byte fixed header + envelope
+# (none, xy, xyz, xym, xyzm); 5-7 are invalid and treated as no envelope
+_HDR_LEN = (8, 8 + 32, 8 + 48, 8 + 48, 8 + 64, 8, 8, 8)
+# WKB byte-order byte -> struct prefix (0 = big endian, anything else little)
+_ENDIAN = ('>', '<')
+
+def _parse_gpkg_header(blob):
+    """(wkb_start, endian, is_little) of a GPKG geometry blob, or None if it is not one / too short for a Point"""
+    if not blob or not blob.startswith(b'GP'): return None
+    flags = blob[3]
+    wkb_start = _HDR_LEN[(flags >> 1) & 0x07]
+    if len(blob) < wkb_start + 21: return None
+    return wkb_start, _ENDIAN[blob[wkb_start] != 0], bool(flags & 1)
+
 def get_xy_from_wkb(blob):
-    if not blob: return 0.0, 0.0
     try:
-        if blob[:2] != b'GP': return 0.0, 0.0
-        flags = blob[3]
-        envelope_indicator = (flags >> 1) & 0x07
-        header_len = 8 
-        if envelope_indicator == 1: header_len += 32
-        elif envelope_indicator == 2: header_len += 48
-        elif envelope_indicator == 3: header_len += 64
-        elif envelope_indicator == 4: header_len += 80
-        wkb_start = header_len
-        if len(blob) < wkb_start + 21: return 0.0, 0.0
-        byte_order = blob[wkb_start] 
-        endian = '>' if byte_order == 0 else '<'
-        geom_type_val = struct.unpack(endian + 'I', blob[wkb_start+1:wkb_start+5])[0]
+        hdr = _parse_gpkg_header(blob)
+        if hdr is None: return 0.0, 0.0
+        wkb_start, endian, _ = hdr
+        geom_type_val = _U32[endian].unpack_from(blob, wkb_start + 1)[0]
         
         if geom_type_val == 1: # Point
-            x_offset = wkb_start + 5
-            x = struct.unpack(endian + 'd', blob[x_offset:x_offset+8])[0]
-            y = struct.unpack(endian + 'd', blob[x_offset+8:x_offset+16])[0]
-            return x, y
+            return _XY[endian].unpack_from(blob, wkb_start + 5)
         elif geom_type_val == 2: # LineString
-            x_offset = wkb_start + 9
-            x = struct.unpack(endian + 'd', blob[x_offset:x_offset+8])[0]
-            y = struct.unpack(endian + 'd', blob[x_offset+8:x_offset+16])[0]
-            return x, y
+            return _XY[endian].unpack_from(blob, wkb_start + 9)
         else:
             return 0.0, 0.0
     except:
         return 0.0, 0.0
 
+def _decode(value):
+    return value.decode("utf-8", "ignore")
+
+# Group code -> converter for the attributes we keep (one dict lookup per pair).
+# The DXF is scanned as raw bytes: float()/int() accept ASCII bytes directly, only text is decoded.
+_ATTR_CONVERTERS = {
+    b'10': float, b'20': float, b'11': float, b'21': float,
+    b'72': int, b'73': int,
+    b'1': _decode,
+}
+
+# Entity type -> int8 code in the parse_dxf_text_info 'type' column
+TYPE_CODES = {'TEXT': 0, 'MTEXT': 1, 'LINE': 2}
+TYPE_NAMES = {v: k for k, v in TYPE_CODES.items()}
+_TYPE_CODES_B = {k.encode(): v for k, v in TYPE_CODES.items()}
+
+def _dxf_pairs(f):
+    """Yield (group code, value) byte pairs straight from the binary file iterator"""
+    it = iter(f)
+    for code in it:
+        value = next(it, None)
+        if value is None:
+            return
+        yield code.strip(), value.strip()
+
 def parse_dxf_text_info(dxf_path):
-    info = {}
+    """TEXT/MTEXT/LINE entities as parallel NumPy columns (one row per entity):
+    handle (object), type (int8, see TYPE_CODES), x10/y10/x11/y11 (float64, NaN if absent),
+    align72/align73 (int8), text (object)."""
+    cols = {k: [] for k in ('handle', 'type', 'x10', 'y10', 'x11', 'y11', 'align72', 'align73', 'text')}
+    nan = float('nan')
     try:
-        with open(dxf_path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.readlines()
-        iterator = iter(lines)
-        current_handle = None
-        current_type = None
-        current_section = None
-        attrs = {}
-        while True:
-            try:
-                code = next(iterator).strip()
-                value = next(iterator).strip()
-            except StopIteration:
-                break
-            if code == '0':
-                if value == 'SECTION':
-                    try:
-                        c2 = next(iterator).strip()
-                        v2 = next(iterator).strip()
-                        if c2 == '2':
-                            current_section = v2
-                    except:
-                        pass
-                elif value == 'ENDSEC':
-                    current_section = None
-
-                if current_handle and current_type in ('TEXT', 'MTEXT', 'LINE'):
-                    info[current_handle] = {
-                        'type': current_type,
-                        'section': current_section,
-                        '10': attrs.get('10'),
-                        '20': attrs.get('20'),
-                        '11': attrs.get('11'),
-                        '21': attrs.get('21'),
-                        '71': attrs.get('71', 0),
-                        '72': attrs.get('72', 0),
-                        '73': attrs.get('73', 0),
-                        '62': attrs.get('62', 256),
-                        '67': attrs.get('67', 0),
-                        '210': attrs.get('210', 0.0),
-                        '220': attrs.get('220', 0.0),
-                        '230': attrs.get('230', 1.0),
-                        '1': attrs.get('1', ''),
-                    }
-                current_type = value
-                current_handle = None
-                attrs = {}
-            elif code == '5':
-                current_handle = value
-            elif code in ('10', '20', '11', '21', '210', '220', '230'):
-                attrs[code] = float(value)
-            elif code in ('71', '72', '73', '62', '67'):
-                attrs[code] = int(value)
-            elif code == '1':
-                attrs[code] = value
+        # Binary mode: no UTF-8 decode of the whole file, group codes compared as byte literals
+        with open(dxf_path, "rb") as f:
+            pairs = _dxf_pairs(f)
+            current_handle = None
+            current_type = None
+            attrs = {}
+            for code, value in pairs:
+                if code == b'0':
+                    if value == b'SECTION':
+                        # Skip the section name pair (2, NAME)
+                        next(pairs, None)
+
+                    type_code = _TYPE_CODES_B.get(current_type)
+                    if current_handle and type_code is not None:
+                        cols['handle'].append(_decode(current_handle))
+                        cols['type'].append(type_code)
+                        cols['x10'].append(attrs.get(b'10', nan))
+                        cols['y10'].append(attrs.get(b'20', nan))
+                        cols['x11'].append(attrs.get(b'11', nan))
+                        cols['y11'].append(attrs.get(b'21', nan))
+                        cols['align72'].append(attrs.get(b'72', 0))
+                        cols['align73'].append(attrs.get(b'73', 0))
+                        cols['text'].append(attrs.get(b'1', ''))
+                    current_type = value
+                    current_handle = None
+                    attrs = {}
+                elif code == b'5':
+                    current_handle = value
+                else:
+                    conv = _ATTR_CONVERTERS.get(code)
+                    if conv is not None:
+                        attrs[code] = conv(value)
     except Exception as e:
         print(f"DXF parse error: {e}")
-    return info
+    # Rows were only ever appended whole, so the columns stay aligned even after a parse error
+    return {
+        'handle': np.array(cols['handle'], dtype=object),
+        'type': np.array(cols['type'], dtype=np.int8),
+        'x10': np.array(cols['x10'], dtype=np.float64),
+        'y10': np.array(cols['y10'], dtype=np.float64),
+        'x11': np.array(cols['x11'], dtype=np.float64),
+        'y11': np.array(cols['y11'], dtype=np.float64),
+        'align72': np.array(cols['align72'], dtype=np.int8),
+        'align73': np.array(cols['align73'], dtype=np.int8),
+        'text': np.array(cols['text'], dtype=object),
+    }
 
 def get_gpkg_text_info(gpkg_path):
     info = {}
     conn = sqlite3.connect(gpkg_path)
+    ensure_indexes(conn)
     c = conn.cursor()
     c.execute("SELECT EntityHandle, geom FROM entities WHERE EntityHandle IS NOT NULL")
     rows = c.fetchall()
@@ -120,6 +156,14 @@ def get_gpkg_text_info(gpkg_path):
     conn.close()
     return info
 
+def _gpkg_mercator(gpkg_info, handles):
+    """First-vertex Web Mercator X/Y arrays for the given GPKG handles"""
+    lon = np.empty(len(handles))
+    lat = np.empty(len(handles))
+    for i, h in enumerate(handles):
+        lon[i], lat[i] = get_xy_from_wkb(gpkg_info[h]['geom'])
+    return wgs84_to_webmercator_arrays(lon, lat)
+
 def analyze_job(job_id):
     job_dir = Path(r"d:\project\LibreDWG\backend\data\jobs") / job_id
     dxf_path = job_dir / "anteen.dxf"
@@ -132,50 +176,40 @@ def analyze_job(job_id):
     print(f"Analyzing job: {gpkg_path}")
 
     # 1. Parse DXF
-    dxf_info = parse_dxf_text_info(dxf_path)
-    print(f"Parsed {len(dxf_info)} text/line entities from DXF")
+    dxf = parse_dxf_text_info(dxf_path)
+    print(f"Parsed {len(dxf['handle'])} text/line entities from DXF")
 
     # 2. Parse GPKG
     gpkg_info = get_gpkg_text_info(gpkg_path)
     print(f"Found {len(gpkg_info)} entities in GPKG")
 
     # 3. Calculate Shift C using LINE entities
-    shift_c_x = 0
-    shift_c_y = 0
-    line_count = 0
-    
     print("\n--- Calibration (LINE Entities) ---")
     print(f"{'Handle':<10} {'DXF_Start':<20} {'GPKG_Start_Merc':<25} {'Shift_X':<15} {'Shift_Y':<15}")
     
-    for handle, d_info in dxf_info.items():
-        if d_info['type'] == 'LINE' and handle in gpkg_info:
-            g_blob = gpkg_info[handle]['geom']
-            g_lon, g_lat = get_xy_from_wkb(g_blob)
-            g_x, g_y = wgs84_to_webmercator(g_lon, g_lat)
-            
-            d_x = d_info['10']
-            d_y = d_info['20']
-            
-            # Shift = DXF - GPKG
-            s_x = d_x - g_x
-            s_y = d_y - g_y
-            
-            # Only print first few
-            if line_count < 5:
-                print(f"{handle:<10} {f'{d_x:.2f},{d_y:.2f}':<20} {f'{g_x:.2f},{g_y:.2f}':<25} {f'{s_x:.2f}':<15} {f'{s_y:.2f}':<15}")
-            
-            shift_c_x += s_x
-            shift_c_y += s_y
-            line_count += 1
-            if line_count >= 10: break
+    gpkg_handles = np.array(list(gpkg_info), dtype=object)
+    # First 10 LINEs (file order) that also exist in the GPKG
+    idx = np.flatnonzero((dxf['type'] == TYPE_CODES['LINE']) & np.isin(dxf['handle'], gpkg_handles))[:10]
+    handles = dxf['handle'][idx]
+    g_x, g_y = _gpkg_mercator(gpkg_info, handles)
+    d_x = dxf['x10'][idx]
+    d_y = dxf['y10'][idx]
+    
+    # Shift = DXF - GPKG
+    s_x = d_x - g_x
+    s_y = d_y - g_y
+    
+    # Only print first few
+    for i in range(min(5, len(idx))):
+        print(f"{handles[i]:<10} {f'{d_x[i]:.2f},{d_y[i]:.2f}':<20} {f'{g_x[i]:.2f},{g_y[i]:.2f}':<25} {f'{s_x[i]:.2f}':<15} {f'{s_y[i]:.2f}':<15}")
             
-    if line_count == 0:
+    if len(idx) == 0:
         print("No matching LINE entities found for calibration!")
         avg_shift_x = 0
         avg_shift_y = 0
     else:
-        avg_shift_x = shift_c_x / line_count
-        avg_shift_y = shift_c_y / line_count
+        avg_shift_x = s_x.mean()
+        avg_shift_y = s_y.mean()
         
     print(f"Average Shift (C): X={avg_shift_x:.2f}, Y={avg_shift_y:.2f}")
 
@@ -186,25 +220,28 @@ def analyze_job(job_id):
     # Specific handles to investigate
     targets = ['59768', '5976C', '59770', '59772', '59776', '593FA']
     
-    for handle in targets:
-        if handle in dxf_info and handle in gpkg_info:
-            d_info = dxf_info[handle]
-            g_blob = gpkg_info[handle]['geom']
-            g_lon, g_lat = get_xy_from_wkb(g_blob)
-            g_x, g_y = wgs84_to_webmercator(g_lon, g_lat)
-            
-            rec_x = g_x + avg_shift_x
-            rec_y = g_y + avg_shift_y
-            
-            d_x10 = d_info['10']
-            d_y10 = d_info['20']
-            d_x11 = d_info.get('11', 0)
-            d_y11 = d_info.get('21', 0)
-            
-            dist_10 = math.sqrt((rec_x - d_x10)**2 + (rec_y - d_y10)**2)
-            
-            print(f"{handle:<10} {d_info.get('type',''):<8} {f'{d_x10:.1f},{d_y10:.1f}':<18} {f'{d_x11:.1f},{d_y11:.1f}':<18} {f'{g_x:.1f},{g_y:.1f}':<18} {f'{rec_x:.1f},{rec_y:.1f}':<18} {f'{dist_10:.1f}':<10}")
-            print(f"  -> BLOB: {g_blob.hex()[:60]}...")
+    # Row of each target in the DXF columns (the last one wins for duplicate handles, as with the old dict)
+    row_of = {h: i for i, h in enumerate(dxf['handle']) if h in targets}
+    found = [h for h in targets if h in row_of and h in gpkg_info]
+    if not found:
+        return
+    rows = np.array([row_of[h] for h in found])
+    g_x, g_y = _gpkg_mercator(gpkg_info, found)
+    
+    rec_x = g_x + avg_shift_x
+    rec_y = g_y + avg_shift_y
+    
+    d_x10 = dxf['x10'][rows]
+    d_y10 = dxf['y10'][rows]
+    d_x11 = dxf['x11'][rows]
+    d_y11 = dxf['y11'][rows]
+    
+    dist_10 = np.hypot(rec_x - d_x10, rec_y - d_y10)
+    
+    for i, handle in enumerate(found):
+        type_name = TYPE_NAMES[int(dxf['type'][rows[i]])]
+        print(f"{handle:<10} {type_name:<8} {f'{d_x10[i]:.1f},{d_y10[i]:.1f}':<18} {f'{d_x11[i]:.1f},{d_y11[i]:.1f}':<18} {f'{g_x[i]:.1f},{g_y[i]:.1f}':<18} {f'{rec_x[i]:.1f},{rec_y[i]:.1f}':<18} {f'{dist_10[i]:.1f}':<10}")
+        print(f"  -> BLOB: {gpkg_info[handle]['geom'].hex()[:60]}...")
 
 
 if __name__ == "__main__":
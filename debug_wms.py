@@ -26,14 +26,24 @@ params = {
 
 auth = (USER, PASS)
 
+OUT_PNG = "debug_wms.png"
+
 print(f"Requesting {GS_URL} with params: {params}")
 try:
-    r = httpx.get(GS_URL, params=params, auth=auth, timeout=60.0)
-    print(f"Status: {r.status_code}")
-    if r.status_code != 200:
-        print("Error content:")
-        print(r.text[:2000])
-    else:
-        print(f"Success! Image received ({len(r.content)} bytes).")
+    # Stream the response: an error body is only read when needed, the image goes to disk chunk by chunk
+    with httpx.Client(auth=auth, timeout=60.0) as client:
+        with client.stream("GET", GS_URL, params=params) as r:
+            print(f"Status: {r.status_code}")
+            if r.status_code != 200:
+                r.read()
+                print("Error content:")
+                print(r.text[:2000])
+            else:
+                size = 0
+                with open(OUT_PNG, "wb") as f:
+                    for chunk in r.iter_bytes(65536):
+                        f.write(chunk)
+                        size += len(chunk)
+                print(f"Success! Image received ({size} bytes) -> {OUT_PNG}")
 except Exception as e:
     print(f"Request failed: {e}")
@@ -0,0 +1,26 @@
+"""Shared by the debug scripts: add query indexes to the entities table and enlarge the SQLite page cache / mmap"""
+import sqlite3
+
+# (columns required, index DDL): an index is only built when its columns exist, older GPKGs without them are skipped
+_INDEXES = (
+    (("entityhandle",), "CREATE INDEX IF NOT EXISTS idx_entities_handle ON entities(EntityHandle)"),
+    (("layer",), "CREATE INDEX IF NOT EXISTS idx_entities_layer ON entities(Layer)"),
+    (("line_color",), "CREATE INDEX IF NOT EXISTS idx_entities_line_color ON entities(line_color)"),
+    # The partial index matches "WHERE Text IS NOT NULL GROUP BY text_color" exactly, so the stats only scan the index
+    (("text_color", "text"),
+     "CREATE INDEX IF NOT EXISTS idx_entities_text_color ON entities(text_color) WHERE Text IS NOT NULL"),
+)
+
+
+def ensure_indexes(conn: sqlite3.Connection) -> None:
+    """Create the indexes (idempotent) and enlarge the cache; a read-only or locked file only prints a notice"""
+    conn.execute("PRAGMA cache_size=-262144")
+    conn.execute("PRAGMA mmap_size=268435456")
+    cols = {r[0].lower() for r in conn.execute("SELECT name FROM pragma_table_info('entities')")}
+    try:
+        for needed, ddl in _INDEXES:
+            if all(col in cols for col in needed):
+                conn.execute(ddl)
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        print(f"Index creation skipped: {e}")
@@ -1,6 +1,65 @@
 import sqlite3
 import os
 import glob
+import struct
+
+from gpkg_indexes import ensure_indexes
+
+# WKB geometry type codes (ISO Z/M/ZM add 1000/2000/3000, so take the code mod 1000)
+_WKB_TYPES = {1: "POINT", 2: "LINESTRING", 3: "POLYGON", 4: "MULTIPOINT",
+              5: "MULTILINESTRING", 6: "MULTIPOLYGON", 7: "GEOMETRYCOLLECTION"}
+# GPKG header length: 8-byte fixed header + envelope
+# (flags bits 1-3: none/xy/xyz/xym/xyzm; 5-7 are invalid and treated as none)
+_HDR_LEN = (8, 8 + 32, 8 + 48, 8 + 48, 8 + 64, 8, 8, 8)
+_U32 = {0: struct.Struct(">I"), 1: struct.Struct("<I")}
+_F64 = {0: struct.Struct(">d"), 1: struct.Struct("<d")}
+_XY = {0: struct.Struct(">2d"), 1: struct.Struct("<2d")}
+
+
+def _wkb_type(blob):
+    """GPKG geometry BLOB -> type name; reads the header only and runs inside SQLite as a scalar function"""
+    try:
+        if not blob or not blob.startswith(b"GP") or blob[3] & 0x10:  # bit4: empty geometry
+            return None
+        wkb_start = _HDR_LEN[(blob[3] >> 1) & 0x07]
+        code = _U32[blob[wkb_start] & 1].unpack_from(blob, wkb_start + 1)[0]
+        return _WKB_TYPES.get(code % 1000, f"UNKNOWN({code})")
+    except (IndexError, struct.error):
+        return None
+
+
+def _gpkg_env(blob, i):
+    """Item i of the GPKG header envelope (0=minx 1=maxx 2=miny 3=maxy) without parsing the WKB body.
+    An envelope-less Point (GDAL writes none for points) yields its own coordinate; other envelope-less geometries give NULL"""
+    try:
+        if not blob or not blob.startswith(b"GP") or blob[3] & 0x10:
+            return None
+        flags = blob[3]
+        if (flags >> 1) & 0x07:
+            # The envelope follows the 8-byte header, in the byte order given by flags bit 0
+            return _F64[flags & 1].unpack_from(blob, 8 + 8 * i)[0]
+        order = blob[8] & 1
+        if _U32[order].unpack_from(blob, 9)[0] % 1000 != 1:
+            return None
+        return _XY[order].unpack_from(blob, 13)[i >> 1]
+    except (IndexError, struct.error):
+        return None
+
+
+def _load_spatialite(conn):
+    """Load mod_spatialite (GPKG amphibious mode); if unavailable, register a pure-Python ST_GeometryType fallback"""
+    try:
+        conn.enable_load_extension(True)
+        conn.load_extension("mod_spatialite")
+        conn.enable_load_extension(False)
+        # Let ST_* accept GPKG BLOBs directly
+        conn.execute("SELECT EnableGpkgAmphibiousMode()")
+        return True
+    except (AttributeError, sqlite3.OperationalError) as e:
+        print(f"mod_spatialite unavailable ({e}); using Python WKB header parser")
+        conn.create_function("ST_GeometryType", 1, _wkb_type, deterministic=True)
+        return False
+
 
 # Try to find the latest modified GPKG
 jobs_dir = r"d:\project\LibreDWG\backend\data\jobs"
@@ -14,6 +73,10 @@ print(f"Inspecting target GPKG: {latest_gpkg}")
 
 conn = sqlite3.connect(latest_gpkg)
 conn.row_factory = sqlite3.Row
+ensure_indexes(conn)
+_load_spatialite(conn)
+# Layer/global bounds read only the 32-byte header envelope per row: no SpatiaLite, no RTree, no WKB body
+conn.create_function("gpkg_env", 2, _gpkg_env, deterministic=True)
 c = conn.cursor()
 
 # 1. Check Columns
@@ -30,53 +93,13 @@ if 'line_color' in columns:
 else:
     print("line_color column missing!")
 
-# 3. Check Geometry Types (using WKB parsing)
-print("\n--- Geometry Types (WKB) ---")
+# 3. Check Geometry Types
+# One aggregate query inside SQLite: BLOBs never reach Python, each row only has its header parsed
+print("\n--- Geometry Types ---")
 try:
-    c.execute("SELECT geom FROM entities")
-    geom_types = {}
-    for row in c:
-        blob = row[0]
-        if not blob:
-            t = "None"
-        else:
-            # GPKG Geometry Header:
-            # Byte 0-1: 'GP' (0x47 0x50)
-            # Byte 2: Version (0)
-            # Byte 3: Flags
-            # Byte 4-??: SRS ID
-            # Then WKB...
-            # But ogr2ogr might write standard WKB or GPKG blob? 
-            # GPKG spec says it MUST be GPKG blob.
-            # Header is at least 8 bytes (flags) + srs_id (4 bytes) = 8 bytes?
-            # header length depends on flags.
-            # Usually we can skip header.
-            # But wait, python sqlite returns bytes.
-            # Let's just look at the WKB type if we can find it.
-            # Simpler: just use hex string of start to guess.
-            pass
-            
-            # Parsing GPKG header
-            # byte 0-1: magic 0x47 0x50
-            # byte 2: version
-            # byte 3: flags. 
-            # bit 0: empty geometry flag.
-            # bit 1-3: envelope type.
-            # bit 4: endianness (0=big, 1=little)
-            # bit 5: srs_id present (always 1 in v1.0?) No.
-            
-            # Let's rely on standard WKB type codes which are usually at offset if we skip header.
-            # But easier: Count by 'geometry_type_name' from gpkg_geometry_columns was 'GEOMETRY'.
-            # That means mixed types are allowed.
-            pass
-            
-    # Actually, better to query:
-    c.execute("SELECT ST_GeometryType(geom), Count(*) FROM entities GROUP BY ST_GeometryType(geom)")
-    # Wait, ST_GeometryType is not available in standard python sqlite3.
-    
-    # Fallback: Count by just parsing the integer type from WKB?
-    # Too complex for quick script.
-    print("Skipping WKB parse (too complex without SpatiaLite).")
+    c.execute("SELECT ST_GeometryType(geom), Count(*) FROM entities GROUP BY 1")
+    for r in c.fetchall():
+        print(f"{r[0]}: {r[1]}")
 except Exception as e:
     print(f"Geometry check error: {e}")
 
@@ -87,9 +110,12 @@ for r in c.fetchall():
     print(f"'{r[0]}': {r[1]}")
 
 # 4. Check 'txt' layer specific
+# '%txt%' cannot use an index: find the matching layer names by scanning idx_entities_layer only,
+# then fetch rows by layer name, avoiding a full table scan over geom BLOBs
+TXT_LAYERS = "Layer IN (SELECT DISTINCT Layer FROM entities WHERE Layer LIKE '%txt%')"
 print("\n--- 'txt' Layer Stats ---")
 try:
-    c.execute("SELECT Layer, text_size, text_color, line_color, anchor_x, anchor_y FROM entities WHERE Layer LIKE '%txt%' LIMIT 20")
+    c.execute(f"SELECT Layer, text_size, text_color, line_color, anchor_x, anchor_y FROM entities WHERE {TXT_LAYERS} LIMIT 20")
     rows = c.fetchall()
     if rows:
         print(f"Found {len(rows)} rows in txt layer:")
@@ -107,15 +133,18 @@ try:
     r = c.fetchone()
     print(f"Min: {r[0]}, Max: {r[1]}, Avg: {r[2]}")
     
+    # Aggregate the per-row header envelopes over all rows instead of reading the first one
+    BOUNDS = "SELECT MIN(gpkg_env(geom, 0)), MAX(gpkg_env(geom, 1)), MIN(gpkg_env(geom, 2)), MAX(gpkg_env(geom, 3)) FROM entities"
+
     # Check Geometry Bounds for txt layer
     print("\n--- Geometry Bounds (txt layer) ---")
-    c.execute("SELECT ST_MinX(geom), ST_MaxX(geom), ST_MinY(geom), ST_MaxY(geom) FROM entities WHERE Layer LIKE '%txt%'")
+    c.execute(f"{BOUNDS} WHERE {TXT_LAYERS}")
     r = c.fetchone()
     print(f"Txt Bounds: X[{r[0]}, {r[1]}], Y[{r[2]}, {r[3]}]")
 
     # Check Global Bounds
     print("\n--- Global Bounds ---")
-    c.execute("SELECT ST_MinX(geom), ST_MaxX(geom), ST_MinY(geom), ST_MaxY(geom) FROM entities")
+    c.execute(BOUNDS)
     r = c.fetchone()
     print(f"Global Bounds: X[{r[0]}, {r[1]}], Y[{r[2]}, {r[3]}]")
 
@@ -2,6 +2,8 @@ import sqlite3
 import sys
 from pathlib import Path
 
+from gpkg_indexes import ensure_indexes
+
 # Correct path found previously
 jobs_dir = Path(r"d:\project\LibreDWG\backend\data\jobs")
 target_job = None
@@ -24,6 +26,7 @@ print(f"Checking GPKG: {gpkg_path}")
 
 try:
     conn = sqlite3.connect(gpkg_path)
+    ensure_indexes(conn)
     c = conn.cursor()
     # Check if 'style' column exists
     c.execute("PRAGMA table_info(entities)")
@@ -9,13 +9,15 @@ from app.services.conversion import convert_dwg_to_gpkg
 
 def test_conversion():
     base = Path(r"d:\project\LibreDWG\backend\data\jobs")
-    jobs = sorted([d for d in base.iterdir() if d.is_dir()], key=lambda x: x.stat().st_mtime, reverse=True)
+    # scandir's DirEntry caches is_dir/stat; only the newest job is needed, so one max() pass replaces a full sort
+    with os.scandir(base) as it:
+        latest = max((e for e in it if e.is_dir()), key=lambda e: e.stat().st_mtime, default=None)
     
-    if not jobs:
+    if latest is None:
         print("No jobs found")
         return
 
-    job = jobs[0]
+    job = Path(latest.path)
     dxf = job / "anteen.dxf"
     # We will write to a test output to avoid breaking the job if possible, 
     # but convert_dwg_to_gpkg writes to output_dir/stem.gpkg
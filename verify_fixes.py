@@ -1,9 +1,15 @@
+import argparse
+import os
 import sqlite3
 import struct
 import math
 import shutil
+from collections import deque
+from multiprocessing import Pool
 from pathlib import Path
 
+import numpy as np
+
 # Job Configuration
 JOB_ID = "21b465d885a54832b5d300e74fda60c9"
 BASE_DIR = Path(r"d:\project\LibreDWG\backend\data\jobs") / JOB_ID
@@ -11,6 +17,23 @@ GPKG_PATH = BASE_DIR / "anteen.gpkg"
 DXF_PATH = BASE_DIR / "anteen.dxf"
 SHIFT_X = 47820.13
 SHIFT_Y = 24419.67
+UPDATE_BATCH = 5000
+# Rows per unit of work handed to a --workers process
+TRANSFORM_BATCH = 10000
+
+# Web Mercator scale factors: degrees -> metres for X, asinh(tan(lat)) -> metres for Y
+_DEG2MERC = 20037508.34 / 180.0
+_MERC_Y = 20037508.34 / math.pi
+_RAD = math.pi / 180.0
+
+# Precompiled WKB codecs keyed by endian prefix ('<' little, '>' big)
+_XY = {"<": struct.Struct("<2d"), ">": struct.Struct(">2d")}
+_U32 = {"<": struct.Struct("<I"), ">": struct.Struct(">I")}
+# GPKG header length by envelope indicator (flags bits 1-3): 8-byte fixed header + envelope
+# (none, xy, xyz, xym, xyzm); 5-7 are invalid and treated as no envelope
+_HDR_LEN = (8, 8 + 32, 8 + 48, 8 + 48, 8 + 64, 8, 8, 8)
+# WKB byte-order byte -> struct prefix (0 = big endian, anything else little)
+_ENDIAN = ('>', '<')
 
 def wgs84_to_webmercator(lon, lat):
     """Convert WGS84 lon/lat to Web Mercator X/Y"""
@@ -20,38 +43,57 @@ def wgs84_to_webmercator(lon, lat):
     if lat > 85.05112878: lat = 85.05112878
     if lat < -85.05112878: lat = -85.05112878
     
-    x = lon * 20037508.34 / 180.0
-    try:
-        y = math.log(math.tan((90 + lat) * math.pi / 360.0)) / (math.pi / 180.0)
-    except:
-        y = 0.0
-    y = y * 20037508.34 / 180.0
+    x = lon * _DEG2MERC
+    # ln(tan(pi/4 + lat/2)) == asinh(tan(lat)): one transcendental fewer, finite after the clamp
+    y = math.asinh(math.tan(lat * _RAD)) * _MERC_Y
     return x, y
 
-def transform_blob(blob, shift_x, shift_y):
+def _reproject_into(out, lon, lat, shift_x, shift_y):
+    """Vectorized wgs84_to_webmercator + shift, writing (x, y) columns into the (n, 2) array out"""
+    lon = np.clip(lon, -180.0, 180.0)
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    out[:, 0] = lon * _DEG2MERC + shift_x
+    out[:, 1] = np.arcsinh(np.tan(lat * _RAD)) * _MERC_Y + shift_y
+    return out
+
+def _transform_points_into(buf, offset, num_points, endian, shift_x, shift_y):
+    """Vectorized wgs84_to_webmercator + shift for num_points packed (lon, lat) doubles at offset,
+    written back through a NumPy view of the bytearray buf (no intermediate bytes)"""
+    dt = np.dtype(endian + 'f8')
+    pts = np.frombuffer(buf, dtype=dt, count=2 * num_points, offset=offset).reshape(num_points, 2)
+    # _reproject_into clips (copies) lon/lat before writing, so updating the view in place is safe
+    _reproject_into(pts, pts[:, 0], pts[:, 1], shift_x, shift_y)
+
+def _parse_gpkg_header(blob):
+    """
+    (wkb_start, endian, is_little) of a GPKG geometry blob, or None if it is not one / too short for a Point.
+    endian is the WKB byte order ('<' / '>'); is_little is the GPKG header's own byte order (flags bit 0).
+    Non-bytes values and truncated headers also give None, so callers pass those rows through unchanged.
+    """
+    if not isinstance(blob, (bytes, bytearray)) or len(blob) < 8 or not blob.startswith(b'GP'): return None
+    flags = blob[3]
+    wkb_start = _HDR_LEN[(flags >> 1) & 0x07]
+    if len(blob) < wkb_start + 21: return None # Min size for Point
+    return wkb_start, _ENDIAN[blob[wkb_start] != 0], bool(flags & 1) # WKB byte order: 0=Big, 1=Little
+
+def transform_blob(blob, shift_x, shift_y, hdr=None):
     """
     Parse GPKG blob (Lat/Lon), Reproject to Mercator, Add Shift, Return new Blob.
+    The new blob is a bytearray patched in place; unsupported input is returned as the same object.
+    hdr: _parse_gpkg_header(blob) if the caller already has it.
     """
     if not blob: return blob
     try:
         # 1. Parse Header
-        if blob[:2] != b'GP': return blob
-        flags = blob[3]
-        envelope_indicator = (flags >> 1) & 0x07
-        header_len = 8 
-        if envelope_indicator == 1: header_len += 32
-        elif envelope_indicator == 2: header_len += 48
-        elif envelope_indicator == 3: header_len += 64
-        elif envelope_indicator == 4: header_len += 80
-        
-        wkb_start = header_len
-        if len(blob) < wkb_start + 21: return blob # Min size for Point
-        
-        byte_order = blob[wkb_start] # 0=Big, 1=Little
-        endian = '>' if byte_order == 0 else '<'
+        if hdr is None:
+            hdr = _parse_gpkg_header(blob)
+            if hdr is None: return blob
+        wkb_start, endian, _ = hdr
         
         # 2. Extract Geometry Type
-        geom_type = struct.unpack(endian + 'I', blob[wkb_start+1:wkb_start+5])[0]
+        xy = _XY[endian]
+        u32 = _U32[endian]
+        geom_type = u32.unpack_from(blob, wkb_start + 1)[0]
         
         # We only handle Point (1), LineString (2), Polygon (3), MultiPoint(4), MultiLineString(5), MultiPolygon(6)
         # But parsing full WKB is complex.
@@ -73,40 +115,36 @@ def transform_blob(blob, shift_x, shift_y):
         # Let's try to handle POINT (Text) specifically first.
         if geom_type == 1: # Point
             x_offset = wkb_start + 5
-            lon = struct.unpack(endian + 'd', blob[x_offset:x_offset+8])[0]
-            lat = struct.unpack(endian + 'd', blob[x_offset+8:x_offset+16])[0]
+            lon, lat = xy.unpack_from(blob, x_offset)
             
             mx, my = wgs84_to_webmercator(lon, lat)
-            new_x = mx + shift_x
-            new_y = my + shift_y
-            
-            new_x_bytes = struct.pack(endian + 'd', new_x)
-            new_y_bytes = struct.pack(endian + 'd', new_y)
             
-            return blob[:x_offset] + new_x_bytes + new_y_bytes + blob[x_offset+16:]
+            buf = bytearray(blob)
+            xy.pack_into(buf, x_offset, mx + shift_x, my + shift_y)
+            return buf
             
         elif geom_type == 2: # LineString
             # Structure: Type(4), NumPoints(4), Point...
-            num_points = struct.unpack(endian + 'I', blob[wkb_start+5:wkb_start+9])[0]
+            num_points = u32.unpack_from(blob, wkb_start + 5)[0]
             current_offset = wkb_start + 9
-            parts = [blob[:current_offset]]
+            # Whole vertex array in one NumPy pass, written back over the same byte range
+            buf = bytearray(blob)
+            _transform_points_into(buf, current_offset, num_points, endian, shift_x, shift_y)
+            return buf
             
-            for _ in range(num_points):
-                lon = struct.unpack(endian + 'd', blob[current_offset:current_offset+8])[0]
-                lat = struct.unpack(endian + 'd', blob[current_offset+8:current_offset+16])[0]
-                
-                mx, my = wgs84_to_webmercator(lon, lat)
-                new_x = mx + shift_x
-                new_y = my + shift_y
-                
-                parts.append(struct.pack(endian + 'd', new_x))
-                parts.append(struct.pack(endian + 'd', new_y))
-                current_offset += 16
-                
-            parts.append(blob[current_offset:])
-            return b''.join(parts)
+        elif geom_type == 3: # Polygon
+            # Structure: Type(4), NumRings(4), then per ring: NumPoints(4), Point...
+            num_rings = u32.unpack_from(blob, wkb_start + 5)[0]
+            current_offset = wkb_start + 9
+            buf = bytearray(blob)
+            for _ in range(num_rings):
+                num_points = u32.unpack_from(blob, current_offset)[0]
+                current_offset += 4
+                _transform_points_into(buf, current_offset, num_points, endian, shift_x, shift_y)
+                current_offset += 16 * num_points
+            return buf
             
-        # For Polygon/Multi*, it's recursive/nested. Too hard to hand-roll reliably in one shot.
+        # For Multi*, it's recursive/nested. Too hard to hand-roll reliably in one shot.
         # But we need to fix them too.
         
         # WORKAROUND:
@@ -124,7 +162,53 @@ def transform_blob(blob, shift_x, shift_y):
         # print(f"Transform error: {e}")
         return blob
 
-def verify_and_fix():
+def _stamp_srs(buf, is_little):
+    """Write SRS id 3857 into the GPKG header at offset 4, in the header byte order."""
+    _U32['<' if is_little else '>'].pack_into(buf, 4, 3857)
+
+def _transform_batch(rows):
+    """[(rowid, blob), ...] -> [(new_blob, rowid), ...] for changed rows, in executemany parameter order.
+    Module-level so multiprocessing can pickle it."""
+    out = []
+    # Points (every TEXT/MTEXT entity) dominate: collect them and reproject the whole batch in one NumPy pass
+    points = []
+    for rid, blob in rows:
+        hdr = _parse_gpkg_header(blob)
+        if hdr is None:
+            continue
+        wkb_start, endian, is_little = hdr
+        geom_type = _U32[endian].unpack_from(blob, wkb_start + 1)[0]
+        if geom_type == 1: # Point
+            points.append((rid, blob, wkb_start + 5, _XY[endian], is_little))
+            continue
+        if geom_type not in (2, 3): # Multi*/others: transform_blob would hand them back untouched
+            continue
+        new_blob = transform_blob(blob, SHIFT_X, SHIFT_Y, hdr)
+        if new_blob is not blob:
+            _stamp_srs(new_blob, is_little)
+            out.append((new_blob, rid))
+    if points:
+        lonlat = np.array([xy.unpack_from(blob, off) for _, blob, off, xy, _ in points], dtype=np.float64)
+        merc = _reproject_into(np.empty_like(lonlat), lonlat[:, 0], lonlat[:, 1], SHIFT_X, SHIFT_Y).tolist()
+        for (rid, blob, off, xy, is_little), (mx, my) in zip(points, merc):
+            buf = bytearray(blob)
+            xy.pack_into(buf, off, mx, my)
+            _stamp_srs(buf, is_little)
+            out.append((buf, rid))
+    return out
+
+def _pooled(pool, batches, window):
+    """Feed batches to the pool from the calling thread (the sqlite cursor must stay on it),
+    keeping at most `window` batches in flight; yields results in submission order."""
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.apply_async(_transform_batch, (batch,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def verify_and_fix(workers=1):
     if not GPKG_PATH.exists():
         print("GPKG not found")
         return
@@ -132,7 +216,12 @@ def verify_and_fix():
     print(f"Backing up {GPKG_PATH}...")
     shutil.copy2(GPKG_PATH, GPKG_PATH.with_suffix(".gpkg.bak"))
 
-    conn = sqlite3.connect(GPKG_PATH)
+    # Autocommit mode + explicit BEGIN/COMMIT: the whole fix pass is one transaction
+    conn = sqlite3.connect(GPKG_PATH, isolation_level=None)
+    # WAL is deliberately not enabled: it would persist in the GPKG that GeoServer later opens
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")
     
     # Mock SpatiaLite
     def mock_bool(*args): return 0
@@ -146,6 +235,7 @@ def verify_and_fix():
     conn.create_function("ST_GeometryType", 1, mock_str)
 
     c = conn.cursor()
+    c.execute("BEGIN")
 
     # 1. Update SRS to 3857 (Web Mercator)
     print("Updating SRS to 3857...")
@@ -164,64 +254,50 @@ def verify_and_fix():
 
     # 2. Fix Geometries (Project & Shift)
     print("Fixing geometries (Reproject + Shift)...")
-    c.execute("SELECT rowid, geom FROM entities")
-    rows = c.fetchall()
+    # Stream rows from a dedicated read cursor; writes go through their own cursor in bounded batches
+    read_c = conn.cursor()
+    read_c.execute("SELECT rowid, geom FROM entities")
+    batches = iter(lambda: read_c.fetchmany(TRANSFORM_BATCH if workers > 1 else UPDATE_BATCH), [])
     
+    # Rows share no state, so the CPU-bound transform can fan out to worker processes;
+    # writes stay in this process on the one connection to avoid SQLite lock contention.
+    pool = Pool(processes=workers) if workers > 1 else None
+    results = _pooled(pool, batches, 2 * workers) if pool else map(_transform_batch, batches)
     count = 0
-    for rid, blob in rows:
-        if blob:
-            new_blob = transform_blob(blob, SHIFT_X, SHIFT_Y)
-            if new_blob != blob:
-                # Update blob
-                # Also we need to update the flags in the header to indicate SRS 3857?
-                # The GPKG header has SRS_ID (bytes 12-15)? No, header structure is different.
-                # GPKG Header: Magic(2), Version(1), Flags(1), SRS_ID(4), Envelope...
-                # We should update SRS_ID in the blob to 3857.
-                
-                # SRS_ID is at offset 4 (4 bytes, int32)
-                # Check byte order
-                byte_order = new_blob[3+1+4] # Wait, standard says:
-                # Byte 0-1: 'GP'
-                # Byte 2: Version
-                # Byte 3: Flags
-                # Byte 4-7: SRS_ID (int32)
-                
-                # We need to respect endianness of the header.
-                # Usually it's Little Endian (1) in flags?
-                # Flags: bit 0: 0=Big, 1=Little.
-                flags = new_blob[3]
-                is_little = (flags & 1) == 1
-                endian = '<' if is_little else '>'
-                
-                # Pack 3857
-                srs_bytes = struct.pack(endian + 'I', 3857)
-                final_blob = new_blob[:4] + srs_bytes + new_blob[8:]
-                
-                c.execute("UPDATE entities SET geom=? WHERE rowid=?", (final_blob, rid))
-                count += 1
-                if count % 1000 == 0:
-                    print(f"Processed {count}...")
-
+    try:
+        for updates in results:
+            if updates:
+                c.executemany("UPDATE entities SET geom=? WHERE rowid=?", updates)
+                count += len(updates)
+                print(f"Processed {count}...")
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
     print(f"Updated {count} geometries.")
 
     # 3. Fix Colors and Attributes
     print("Fixing attributes...")
-    # Map Black to White (since background is black)
-    c.execute("UPDATE entities SET line_color='#FFFFFF' WHERE line_color='#000000'")
-    c.execute("UPDATE entities SET text_color='#FFFFFF' WHERE text_color='#000000'")
-    
-    # Ensure not NULL for lines (default to White)
-    c.execute("UPDATE entities SET line_color='#FFFFFF' WHERE line_color IS NULL")
-    
-    # Ensure text_size is valid (default to 2.5 if missing)
-    c.execute("UPDATE entities SET text_size=2.5 WHERE text_size IS NULL OR text_size=0")
-    
-    # Ensure text_color is valid
-    c.execute("UPDATE entities SET text_color='#FFFFFF' WHERE text_color IS NULL")
+    # One scan, one write per touched row:
+    # - Map Black to White (since background is black); missing line/text colors default to White
+    # - Ensure text_size is valid (default to 2.5 if missing)
+    c.execute("""
+        UPDATE entities SET
+            line_color = CASE WHEN line_color IS NULL OR line_color='#000000' THEN '#FFFFFF' ELSE line_color END,
+            text_color = CASE WHEN text_color IS NULL OR text_color='#000000' THEN '#FFFFFF' ELSE text_color END,
+            text_size  = CASE WHEN text_size IS NULL OR text_size=0 THEN 2.5 ELSE text_size END
+        WHERE line_color IS NULL OR line_color='#000000'
+           OR text_color IS NULL OR text_color='#000000'
+           OR text_size IS NULL OR text_size=0
+    """)
     
-    conn.commit()
+    c.execute("COMMIT")
     conn.close()
     print("Fixes applied successfully.")
 
 if __name__ == "__main__":
-    verify_and_fix()
+    parser = argparse.ArgumentParser(description="Reproject + shift the entities layer of the job GPKG to EPSG:3857")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for the geometry transform (0 = os.cpu_count(); default 1, in-process)")
+    args = parser.parse_args()
+    verify_and_fix(args.workers if args.workers > 0 else os.cpu_count() or 1)